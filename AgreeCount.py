@@ -3,70 +3,243 @@ import json
 import time
 from datetime import datetime
 import os
+import random
+import calendar
+from collections import deque
+from sample_channel import publish_sample
+from agree_log import BINARY_FILE_NAME, RECORD_DTYPE, append_binary_record, convert_text_log, load_binary_log, parse_log_lines, write_binary_log
+from series_store import AGREE_SERIES, STORE_FILE_NAME, open_store
 
 MAX_LOG_LINES = 80000
+COMPACT_LOG_LINES = 90000  # Trim back to MAX_LOG_LINES only once the log grows past this
 LOG_FILE_NAME = "AgreeCountLog.txt"
+LOG_CHANGES_ONLY = True  # Only write a line when the count changes (plus heartbeats)
+HEARTBEAT_INTERVAL = 300  # seconds, an unchanged count is still logged this often
+WRITE_BINARY_LOG = True  # Also append each logged sample to the fixed-width BINARY_FILE_NAME
+WRITE_STORE = True  # Also store each logged sample in the shared STORE_FILE_NAME database
 TIMEOUT = 45  # seconds
 RETRY_DELAY = 3  # seconds
+MAX_RETRY_DELAY = 60  # seconds, upper bound for the backoff
+MIN_POLL_INTERVAL = 3  # seconds, used while the count is moving fast
+MAX_POLL_INTERVAL = 30  # seconds, used while the count stays flat
+TARGET_CHANGE_PER_POLL = 20  # Agrees we aim to see between two polls
+RATE_WINDOW = 10  # Recent samples used to estimate the rate of change
+
+AGREE_COUNT_URL = "https://petitions.assembly.go.kr/api/petits/14CBAF8CE5733410E064B49691C1987F?petitId=14CBAF8CE5733410E064B49691C1987F&sttusCode="
+
+HEADERS = {
+    "Host": "petitions.assembly.go.kr",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "ko-KR,ko;q=0.8,en-US;q=0.5,en;q=0.3",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Priority": "u=1"
+}
+
+# Keep-alive session so each poll reuses the TCP/TLS connection
+session = requests.Session()
+session.headers.update(HEADERS)
+
+fetch_state = {
+    'etag': None,  # Validators sent back on the next request, if the API provides them
+    'last_modified': None,
+    'count': None,  # Last count received, returned again on 304 Not Modified
+    'failures': 0,  # Consecutive failed attempts, drives the backoff
+    'latency': None,  # Seconds taken by the last request
+    'latencies': deque(maxlen=100)
+}
+
+# Function to compute the retry delay: exponential backoff with jitter
+def backoff_delay(failures):
+    ceiling = min(MAX_RETRY_DELAY, RETRY_DELAY * (2 ** (failures - 1)))
+    return random.uniform(RETRY_DELAY, max(RETRY_DELAY, ceiling))
+
+def record_latency(started):
+    latency = time.monotonic() - started
+    fetch_state['latency'] = latency
+    fetch_state['latencies'].append(latency)
 
 def get_agree_count():
-    url = "https://petitions.assembly.go.kr/api/petits/14CBAF8CE5733410E064B49691C1987F?petitId=14CBAF8CE5733410E064B49691C1987F&sttusCode="
-    
-    headers = {
-        "Host": "petitions.assembly.go.kr",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:127.0) Gecko/20100101 Firefox/127.0",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-        "Accept-Language": "ko-KR,ko;q=0.8,en-US;q=0.5,en;q=0.3",
-        "Accept-Encoding": "gzip, deflate, br, zstd",
-        "Connection": "keep-alive",
-        "Upgrade-Insecure-Requests": "1",
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": "none",
-        "Sec-Fetch-User": "?1",
-        "Priority": "u=1"
-    }
-    
     while True:
+        request_headers = {}
+        if fetch_state['etag']:
+            request_headers["If-None-Match"] = fetch_state['etag']
+        if fetch_state['last_modified']:
+            request_headers["If-Modified-Since"] = fetch_state['last_modified']
+
+        started = time.monotonic()
         try:
-            response = requests.get(url, headers=headers, timeout=TIMEOUT)
+            response = session.get(AGREE_COUNT_URL, headers=request_headers, timeout=TIMEOUT)
+            record_latency(started)
+            if response.status_code == 304:
+                if fetch_state['count'] is not None:
+                    fetch_state['failures'] = 0
+                    return fetch_state['count']
+                # No count to repeat: drop the validators and ask again for a full body
+                fetch_state['etag'] = None
+                fetch_state['last_modified'] = None
+                continue
             response.raise_for_status()
             data = response.json()
-            return data.get('agreCo')
+            fetch_state['count'] = data.get('agreCo')
+            # Validators are only kept together with a count, so a later 304 always has one to return
+            has_count = fetch_state['count'] is not None
+            fetch_state['etag'] = response.headers.get("ETag") if has_count else None
+            fetch_state['last_modified'] = response.headers.get("Last-Modified") if has_count else None
+            fetch_state['failures'] = 0
+            return fetch_state['count']
         except requests.exceptions.Timeout:
-            print(f"Request timed out after {TIMEOUT} seconds. Retrying in {RETRY_DELAY} seconds...")
-        except requests.exceptions.RequestException as e:
-            print(f"An error occurred: {e}. Retrying in {RETRY_DELAY} seconds...")
-        
-        time.sleep(RETRY_DELAY)
+            record_latency(started)
+            fetch_state['failures'] += 1
+            delay = backoff_delay(fetch_state['failures'])
+            print(f"Request timed out after {TIMEOUT} seconds. Retrying in {delay:.1f} seconds...")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            fetch_state['failures'] += 1
+            delay = backoff_delay(fetch_state['failures'])
+            print(f"An error occurred: {e}. Retrying in {delay:.1f} seconds...")
+
+        time.sleep(delay)
+
+log_line_count = None  # Lines in the log file, counted once and then tracked in memory
+
+def count_log_lines():
+    with open(LOG_FILE_NAME, 'rb') as file:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: file.read(1 << 20), b''))
 
 def manage_log_file():
+    global log_line_count
     if not os.path.exists(LOG_FILE_NAME):
+        log_line_count = 0
+        return
+
+    if log_line_count is None:
+        log_line_count = count_log_lines()
+
+    if log_line_count <= COMPACT_LOG_LINES:
         return
 
     with open(LOG_FILE_NAME, 'r') as file:
-        lines = file.readlines()
+        lines = deque(file, maxlen=MAX_LOG_LINES)
+
+    # Write the trimmed log next to the old one and swap it in atomically
+    temp_file_name = LOG_FILE_NAME + ".tmp"
+    with open(temp_file_name, 'w') as file:
+        file.writelines(lines)
+    os.replace(temp_file_name, LOG_FILE_NAME)
+    log_line_count = len(lines)
+
+# Same hysteresis for the binary log; its record count is just the file size
+def manage_binary_log():
+    records = os.path.getsize(BINARY_FILE_NAME) // RECORD_DTYPE.itemsize
+    if records <= COMPACT_LOG_LINES:
+        return
+
+    log = load_binary_log(BINARY_FILE_NAME)[-MAX_LOG_LINES:]
+    write_binary_log(log['epoch'], log['count'], BINARY_FILE_NAME)
+
+last_logged = {
+    'count': None,
+    'time': None  # monotonic time of the last written line
+}
 
-    if len(lines) > MAX_LOG_LINES:
-        with open(LOG_FILE_NAME, 'w') as file:
-            file.writelines(lines[-MAX_LOG_LINES:])
+# Function to decide whether a sample is worth a log line in change-only mode
+def should_log(count):
+    if not LOG_CHANGES_ONLY or last_logged['count'] != count:
+        return True
+    return time.monotonic() - last_logged['time'] >= HEARTBEAT_INTERVAL
 
 def log_agree_count(count):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    global log_line_count
+    if not should_log(count):
+        return False
+    last_logged['count'] = count
+    last_logged['time'] = time.monotonic()
+
+    now = datetime.now()
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
     log_entry = f"{timestamp}: Agree Count = {count}\n"
     
     with open(LOG_FILE_NAME, "a") as log_file:
         log_file.write(log_entry)
-    
+
+    if log_line_count is not None:
+        log_line_count += 1
     manage_log_file()
 
+    if WRITE_BINARY_LOG:
+        append_binary_record(calendar.timegm(now.timetuple()), count, BINARY_FILE_NAME)
+        manage_binary_log()
+
+    if WRITE_STORE:
+        try:
+            store = open_store(STORE_FILE_NAME)
+            store.append(AGREE_SERIES, calendar.timegm(now.timetuple()), count)
+            store.maybe_apply_retention(AGREE_SERIES)
+        except Exception as e:
+            print(f"Error writing to {STORE_FILE_NAME}: {e}")
+    return True
+
+# Function to copy the existing text log into the store the first time it is used
+def import_log_into_store():
+    store = open_store(STORE_FILE_NAME)
+    if not store.is_empty(AGREE_SERIES) or not os.path.exists(LOG_FILE_NAME):
+        return 0
+    with open(LOG_FILE_NAME, 'r') as file:
+        epochs, counts = parse_log_lines(file)
+    store.append_many(AGREE_SERIES, epochs, counts)
+    return len(epochs)
+
+recent_samples = deque(maxlen=RATE_WINDOW)  # (monotonic time, count) of the latest polls
+
+# Function to pick the next poll interval from the recent rate of change and upstream latency
+def next_poll_interval(previous_interval):
+    if len(recent_samples) < 2:
+        return MIN_POLL_INTERVAL
+
+    first_time, first_count = recent_samples[0]
+    previous_time, previous_count = recent_samples[-2]
+    last_time, last_count = recent_samples[-1]
+    window_rate = abs(last_count - first_count) / max(last_time - first_time, 1e-6)
+    # The last step alone reacts at once when a quiet period turns into a surge
+    step_rate = abs(last_count - previous_count) / max(last_time - previous_time, 1e-6)
+    rate = max(window_rate, step_rate)
+
+    if rate > 0:
+        interval = TARGET_CHANGE_PER_POLL / rate
+    else:
+        interval = previous_interval * 1.5
+
+    # Never keep the upstream busy for more than half of the time
+    interval = max(interval, 2 * (fetch_state['latency'] or 0))
+    return min(MAX_POLL_INTERVAL, max(MIN_POLL_INTERVAL, interval))
+
 def main():
+    if WRITE_BINARY_LOG and not os.path.exists(BINARY_FILE_NAME) and os.path.exists(LOG_FILE_NAME):
+        converted = convert_text_log(LOG_FILE_NAME, BINARY_FILE_NAME)
+        print(f"Converted {converted} existing entries to {BINARY_FILE_NAME}")
+    if WRITE_STORE:
+        imported = import_log_into_store()
+        if imported:
+            print(f"Imported {imported} existing entries into {STORE_FILE_NAME}")
+
+    interval = MIN_POLL_INTERVAL
     while True:
         agree_count = get_agree_count()
         if agree_count is not None:
-            log_agree_count(agree_count)
-            print(f"Logged agree count: {agree_count}")
-        time.sleep(RETRY_DELAY)
+            recent_samples.append((time.monotonic(), agree_count))
+            if log_agree_count(agree_count):
+                print(f"Logged agree count: {agree_count}")
+            # Wake the web apps right away (unchanged samples keep them from falling back to polling)
+            publish_sample(calendar.timegm(datetime.now().timetuple()), agree_count)
+        interval = next_poll_interval(interval)
+        # The interval runs from request start to request start
+        time.sleep(max(0, interval - (fetch_state['latency'] or 0)))
 
 if __name__ == "__main__":
     main()
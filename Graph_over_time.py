@@ -1,34 +1,147 @@
 from flask import Flask, render_template_string, jsonify
+import os
+import numpy as np
 import pandas as pd
 import requests
-import json
 import time
-import threading
+from agree_log import default_log_path, get_series
+from http_cache import VersionedCache, conditional_response, make_etag
+from series_store import WAIT_SERIES, open_store, store_exists
+from wait_store import columnar_path, journal_path, load_wait_columns, to_time_strings
 
 app = Flask(__name__)
 
-# Initialize cache variables and lock
-cache_data = None
-cache_timestamp = 0
-CACHE_TIMEOUT = 180  # Cache timeout in seconds (3 minutes)
-cache_lock = threading.Lock()
-
-# Function to fetch wait times data from JSON file
-def fetch_wait_times(file_path):
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-    df = pd.DataFrame(data, columns=["time", "count"])
-    df["time"] = pd.to_datetime(df["time"])
-    return df
+WAIT_TIMES_FILE = 'wait_times.json'
+PETITION_DATA_URL = 'https://petitions-agreecount-01.fediverses.kr/api/1_hour_update/json'
+DATA_SOURCE = 'local'  # 'local' reads the AgreeCount log on this host, 'http' asks the AgreeCount site
+TIMEOUT = 10  # seconds to wait for the AgreeCount site
+CACHE_TIMEOUT = 180  # seconds between refreshes of data that comes over HTTP (3 minutes)
+GRID_STEP = 60  # seconds between points of the shared time grid
+MAX_GRID_POINTS = 20000  # the step grows in whole minutes to stay under this
+JOINED_WINDOW = 3600  # agreements are counted over the hour up to each grid point
+WAIT_MAX_AGE = 120  # seconds a wait sample stands for before the graph shows a gap
+
+plot_cache = VersionedCache(maxsize=4)  # One entry per data version, recomputed outside any lock
 
 # Function to fetch petition data from API
 def fetch_petition_data(url):
-    response = requests.get(url)
+    response = requests.get(url, timeout=TIMEOUT)
+    response.raise_for_status()
     data = response.json()
     df = pd.DataFrame(data)
     df["hour"] = pd.to_datetime(df["hour"])
     return df
 
+# Reads agree counts straight from the AgreeCount log on this host
+class LocalAgreeSource:
+    max_age = None  # The log records every change, so the last count holds until the next one
+    def available(self):
+        return os.path.exists(default_log_path())
+
+    def version(self):
+        series = get_series(default_log_path())
+        series.refresh()
+        return series.content_key()
+
+    # Epoch seconds and agree counts, as a step series
+    def load(self):
+        return get_series(default_log_path()).arrays()
+
+# Falls back to the AgreeCount site's hourly summary, refreshed every CACHE_TIMEOUT
+class HttpAgreeSource:
+    max_age = 3600  # One count per hour; past the last one the count is unknown
+
+    def __init__(self, url=PETITION_DATA_URL):
+        self.url = url
+
+    def available(self):
+        return True
+
+    def version(self):
+        return int(time.time() // CACHE_TIMEOUT)
+
+    def load(self):
+        petition_df = fetch_petition_data(self.url)
+        epochs = petition_df['hour'].values.astype('datetime64[s]').astype(np.int64)
+        return epochs, petition_df['count'].to_numpy(np.int64)
+
+agree_sources = {
+    'local': LocalAgreeSource(),
+    'http': HttpAgreeSource()
+}
+
+# Function to pick the configured source, or the HTTP one when the local log is not on this host
+def get_agree_source():
+    source = agree_sources[DATA_SOURCE]
+    if source.available():
+        return DATA_SOURCE, source
+    return 'http', agree_sources['http']
+
+# Function to check whether check_waiting writes its samples to the shared store
+def wait_store_ready():
+    return store_exists() and not open_store().is_empty(WAIT_SERIES)
+
+# Function to load the wait series from the shared store, else from wait_times.json and its journal
+def load_wait_series(file_path):
+    if wait_store_ready():
+        return open_store().range(WAIT_SERIES)
+    return load_wait_columns(file_path)
+
+# Function to identify the wait data without reading it
+def wait_version(file_path):
+    if wait_store_ready():
+        return ('store', open_store().version(WAIT_SERIES))
+    version = []
+    for path in (file_path, columnar_path(file_path), journal_path(file_path)):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+# Function to take the last value at or before every grid point; NaN before the series starts
+# or once its last value is older than max_age
+def sample_at(epochs, values, grid, max_age=None):
+    result = np.full(len(grid), np.nan)
+    if not len(epochs):
+        return result
+    index = np.searchsorted(epochs, grid, side='right') - 1
+    valid = index >= 0
+    if max_age is not None:
+        valid &= grid - epochs[np.maximum(index, 0)] <= max_age
+    result[valid] = values[index[valid]]
+    return result
+
+# Function to lay out a grid of whole-minute steps covering every series given; returns (grid, step)
+def make_grid(*epoch_arrays):
+    present = [epochs for epochs in epoch_arrays if len(epochs)]
+    if not present:
+        return np.empty(0, dtype=np.int64), GRID_STEP
+    first = min(int(epochs[0]) for epochs in present)
+    last = max(int(epochs[-1]) for epochs in present)
+    step = GRID_STEP * max(1, -(-(last - first) // (GRID_STEP * MAX_GRID_POINTS)))
+    return np.arange(first // step * step, last + step, step, dtype=np.int64), step
+
+# Function to turn a float array into JSON-ready ints, with None for the gaps
+def to_json_values(values):
+    return [None if value != value else int(value) for value in values.tolist()]
+
+# Function to build the plot data: both series resampled onto one shared time grid
+def build_plot_data(source):
+    wait_epochs, wait_counts = load_wait_series(WAIT_TIMES_FILE)
+    agree_epochs, agree_counts = source.load()
+    grid, step = make_grid(wait_epochs, agree_epochs)
+
+    waiting = sample_at(wait_epochs, wait_counts, grid, max(WAIT_MAX_AGE, step))
+    joined = (sample_at(agree_epochs, agree_counts, grid, source.max_age)
+              - sample_at(agree_epochs, agree_counts, grid - JOINED_WINDOW, source.max_age))
+    return jsonify({
+        'time': to_time_strings(grid),
+        'count': to_json_values(waiting),
+        'joined': to_json_values(joined)
+    })
+
 # Flask route for the main page
 @app.route('/')
 def index():
@@ -81,7 +194,7 @@ def index():
                     yaxis: 'y'
                 };
                 var trace2 = {
-                    x: data.hour,
+                    x: data.time,
                     y: data.joined,
                     mode: 'lines',
                     name: '추가 동의자수(1시간)',
@@ -102,37 +215,16 @@ def index():
     </html>
     """)
 
-# Flask route to provide data for the plot
+# Flask route to provide data for the plot. Built once per data version; while one request
+# rebuilds it the others keep getting the previous data, so a slow source never stalls them all.
 @app.route('/plot-data')
 def plot_data():
-    global cache_data, cache_timestamp
-    current_time = time.time()
-    
-    # Check if cached data is still valid
-    if cache_data is not None and (current_time - cache_timestamp) < CACHE_TIMEOUT:
-        return jsonify(cache_data)
-    
-    with cache_lock:
-        # Double-check the cache within the lock
-        if cache_data is not None and (current_time - cache_timestamp) < CACHE_TIMEOUT:
-            return jsonify(cache_data)
-        
-        # Fetch new data
-        wait_times_df = fetch_wait_times('wait_times.json')
-        petition_df = fetch_petition_data('https://petitions-agreecount-01.fediverses.kr/api/1_hour_update/json')
-
-        data = {
-            'time': wait_times_df['time'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist(),
-            'count': wait_times_df['count'].tolist(),
-            'hour': petition_df['hour'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist(),
-            'joined': petition_df['joined'].tolist()
-        }
-
-        # Update cache
-        cache_data = data
-        cache_timestamp = current_time
-    
-    return jsonify(data)
+    name, source = get_agree_source()
+    version = (name, source.version(), wait_version(WAIT_TIMES_FILE))
+    def etag(served):
+        return make_etag('plot-data', served)
+    return conditional_response(etag(version),
+                                lambda: plot_cache.response('plot-data', version, lambda: build_plot_data(source), etag))
 
 if __name__ == '__main__':
     app.run(debug=True, port=3211)
@@ -1,14 +1,14 @@
 from flask import Flask, render_template_string
 import plotly.express as px
-import pandas as pd
 from datetime import datetime
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit
 import threading
 import time
-import os
 import json
 import plotly
 import logging
+from sample_channel import FALLBACK_INTERVAL, open_subscriber
+from agree_log import default_log_path, get_series
 
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*")
@@ -22,20 +22,16 @@ log.setLevel(logging.WARNING)
 
 user_count = 0  # Global counter for connected users
 
-# Function to read the log file and return a DataFrame
+# Function to read the log file and return a DataFrame (only new lines are parsed)
 def read_log_file(file_path):
-    data = []
-    with open(file_path, 'r') as file:
-        for line in file:
-            parts = line.split(': Agree Count = ')
-            timestamp = datetime.strptime(parts[0], '%Y-%m-%d %H:%M:%S')
-            agree_count = int(parts[1].strip())
-            data.append({'timestamp': timestamp, 'agree_count': agree_count})
-    return pd.DataFrame(data)
+    series = get_series(file_path)
+    series.refresh()
+    return series.dataframe()
 
 # Function to create an interactive graph using Plotly
 def create_graph(dataframe):
-    fig = px.line(dataframe, x='timestamp', y='agree_count', title='Agree Count Over Time')
+    # Change-only logs hold a count until the next line, so draw steps
+    fig = px.line(dataframe, x='timestamp', y='agree_count', title='Agree Count Over Time', line_shape='hv')
     fig.update_layout(
         xaxis_title='Timestamp',
         yaxis_title='Agree Count',
@@ -51,34 +47,86 @@ def create_graph(dataframe):
 # Global variable to control updates
 update_active = True
 
-# Function to check for file changes and emit updates
+# Identifies one continuous run of rows; it changes when the log is trimmed or replaced
+def stream_id(series):
+    return f"{series.file_path}:{series.generation}"
+
+# Function to format epochs the way Plotly expects them
+def format_times(epochs):
+    return [stamp.replace('T', ' ') for stamp in epochs.astype('datetime64[s]').astype(str)]
+
+# Function to build the full figure payload a client needs to (re)start applying deltas
+def full_payload(series):
+    df = series.dataframe()
+    latest_count = df['agree_count'].iloc[-1] if not df.empty else 'No data available'
+    latest_timestamp = df['timestamp'].iloc[-1].strftime('%Y-%m-%d %H:%M:%S') if not df.empty else 'No data available'
+    fig = create_graph(df)
+    return {
+        'stream': stream_id(series),
+        'seq': len(df),
+        'latest_count': str(latest_count),
+        'latest_timestamp': latest_timestamp,
+        'graph': json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+    }
+
+resync_cache = {'version': None, 'payload': None}
+resync_lock = threading.Lock()
+
+# Full payload, built once per data version however many clients ask for it
+def get_full_payload():
+    series = get_series(default_log_path())
+    series.refresh()
+    version = (stream_id(series), series.version)
+    with resync_lock:
+        if resync_cache['version'] != version:
+            resync_cache['payload'] = full_payload(series)
+            resync_cache['version'] = version
+        return resync_cache['payload']
+
+# Function to emit only the rows appended since the last broadcast, with sequence numbers
+def broadcast_new_rows(sent):
+    series = get_series(default_log_path())
+    series.refresh()
+    stream = stream_id(series)
+    epochs, counts = series.arrays()
+    seq = len(epochs)
+    if stream == sent['stream'] and seq == sent['seq']:
+        return
+
+    start = sent['seq'] if stream == sent['stream'] and seq > sent['seq'] else seq
+    # A new stream carries no rows; clients notice the change and ask for a resync
+    socketio.emit('update', {
+        'stream': stream,
+        'from': start,
+        'seq': seq,
+        'x': format_times(epochs[start:seq]),
+        'y': counts[start:seq].tolist(),
+        'latest_count': str(counts[-1]) if seq else 'No data available',
+        'latest_timestamp': format_times(epochs[-1:])[0] if seq else 'No data available'
+    })
+    sent['stream'] = stream
+    sent['seq'] = seq
+
+# Function to emit updates when AgreeCount publishes a sample, falling back to checking the file
 def check_file_changes():
     global update_active
-    file_path = 'AgreeCountLog.txt'
-    last_modified = os.path.getmtime(file_path)
-    
+    series = get_series(default_log_path())
+    series.refresh()
+    sent = {'stream': stream_id(series), 'seq': len(series)}  # What clients were last told about
+    subscriber = open_subscriber('website')
+
     while True:
-        time.sleep(1)
+        if subscriber is not None:
+            subscriber.wait()  # Returns on a new sample, or after the fallback timeout
+        else:
+            time.sleep(FALLBACK_INTERVAL)
         if update_active:
-            current_modified = os.path.getmtime(file_path)
-            if current_modified > last_modified:
-                df = read_log_file(file_path)
-                latest_count = df['agree_count'].iloc[-1] if not df.empty else 'No data available'
-                latest_timestamp = df['timestamp'].iloc[-1].strftime('%Y-%m-%d %H:%M:%S') if not df.empty else 'No data available'
-                fig = create_graph(df)
-                graph_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-                socketio.emit('update', {'latest_count': str(latest_count), 'latest_timestamp': latest_timestamp, 'graph': graph_json})
-                last_modified = current_modified
+            broadcast_new_rows(sent)
 
 # Route for the main page
 @app.route('/')
 def index():
-    file_path = 'AgreeCountLog.txt'
-    df = read_log_file(file_path)
-    latest_count = df['agree_count'].iloc[-1] if not df.empty else 'No data available'
-    latest_timestamp = df['timestamp'].iloc[-1].strftime('%Y-%m-%d %H:%M:%S') if not df.empty else 'No data available'
-    fig = create_graph(df)
-    graph_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+    payload = get_full_payload()
 
     html_template = '''
     <!DOCTYPE html>
@@ -179,22 +227,44 @@ def index():
                 var socket = io();
                 var graphData = JSON.parse('{{ graph_json | safe }}');
                 Plotly.newPlot('graph-container', graphData.data, graphData.layout);
+                var stream = {{ stream | tojson }};
+                var seq = {{ seq }};
 
                 var updateActive = true;
 
+                function showLatest(data) {
+                    document.getElementById('latest-count').textContent = data.latest_count;
+                    document.getElementById('latest-timestamp').textContent = data.latest_timestamp;
+                }
+
                 socket.on('connect', function() {
                     console.log('WebSocket connected');
                 });
                 socket.on('update', function(data) {
                     if (updateActive) {
                         console.log('Received update:', data);
-                        document.getElementById('latest-count').textContent = data.latest_count;
-                        document.getElementById('latest-timestamp').textContent = data.latest_timestamp;
-                        var updatedGraph = JSON.parse(data.graph);
-                        Plotly.react('graph-container', updatedGraph.data, updatedGraph.layout);
+                        if (data.stream !== stream || data.from > seq) {
+                            // The log was trimmed or we missed rows: ask for the full graph again
+                            socket.emit('resync');
+                            return;
+                        }
+                        var skip = seq - data.from;
+                        if (data.x.length > skip) {
+                            Plotly.extendTraces('graph-container', {x: [data.x.slice(skip)], y: [data.y.slice(skip)]}, [0]);
+                            seq = data.seq;
+                        }
+                        showLatest(data);
                     }
                 });
 
+                socket.on('resync', function(data) {
+                    var updatedGraph = JSON.parse(data.graph);
+                    Plotly.react('graph-container', updatedGraph.data, updatedGraph.layout);
+                    stream = data.stream;
+                    seq = data.seq;
+                    showLatest(data);
+                });
+
                 socket.on('user_count', function(data) {
                     document.getElementById('user-count').textContent = data.count;
                 });
@@ -207,6 +277,7 @@ def index():
 
                 document.getElementById('resumeUpdate').addEventListener('click', function() {
                     updateActive = true;
+                    socket.emit('resync');  // Pick up the rows skipped while paused
                     this.style.display = 'none';
                     document.getElementById('stopUpdate').style.display = 'inline-block';
                 });
@@ -236,7 +307,12 @@ def index():
     </html>
     '''
 
-    return render_template_string(html_template, latest_count=latest_count, latest_timestamp=latest_timestamp, graph_json=graph_json)
+    return render_template_string(html_template, latest_count=payload['latest_count'], latest_timestamp=payload['latest_timestamp'], graph_json=payload['graph'], stream=payload['stream'], seq=payload['seq'])
+
+# Sent to a single client that noticed a gap in the sequence numbers
+@socketio.on('resync')
+def handle_resync():
+    emit('resync', get_full_payload())
 
 @socketio.on('connect')
 def handle_connect():
@@ -1,7 +1,8 @@
-from flask import Flask, render_template_string, send_file, send_from_directory, make_response, jsonify
+from flask import Flask, render_template_string, send_file, send_from_directory, make_response, jsonify, request
 import matplotlib
 matplotlib.use('Agg')  # Use Agg backend for rendering plots
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import pandas as pd
 from flask_cors import CORS
 import numpy as np  # Import numpy
@@ -12,10 +13,13 @@ import time
 import os
 import io
 import logging
-from functools import wraps
-from cachetools import TTLCache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from http_cache import CACHE_CONTROL, VersionedCache, cached, conditional_response, file_chunks, make_etag, streaming_response, wants_gzip
+from rollups import epoch_to_datetime, make_tiers, parse_bucket_query, parse_time_param, update_tiers
+from forecast import OnlineRegression
+from sample_channel import FALLBACK_INTERVAL, open_subscriber
+from agree_log import BINARY_FILE_NAME, LOG_FILE_NAME, default_log_path, format_log_lines, get_series, resample_steps
 
 app = Flask(__name__)
 CORS(app)
@@ -28,69 +32,189 @@ log = logging.getLogger('werkzeug')
 log.setLevel(logging.WARNING)
 
 update_active = True  # Global variable to control updates
-graph_cache = None  # Cache for the graph image
-last_modified = 0  # Timestamp of the last modification to the log file
+graph_cache = None  # PNG bytes of the latest graph
+graph_version = None  # Data version graph_cache was rendered from
+graph_lock = threading.Lock()
+GRAPH_WIDTH_PIXELS = 1000  # figsize 10in at the default 100 dpi
 user_count = 0  # Global counter for connected users
 
-# Function to read the log file and return a DataFrame
+# Function to read the log file and return a DataFrame (only new lines are parsed)
 def read_log_file(file_path):
     try:
-        data = pd.read_csv(file_path, sep=': Agree Count = ', header=None, names=['timestamp', 'agree_count'], engine='python')
-        data['timestamp'] = pd.to_datetime(data['timestamp'], format='%Y-%m-%d %H:%M:%S')
-        data['agree_count'] = data['agree_count'].astype(int)
-        return data
+        series = get_series(file_path)
+        series.refresh()
+        return series.dataframe()
     except Exception as e:
         app.logger.error(f"Error reading log file: {e}")
         return pd.DataFrame()
 
+# Function to get the shared series, refreshed with any new samples
+def read_series():
+    series = get_series(default_log_path())
+    series.refresh()
+    return series
+
+# Function to keep the first, last, min and max point of each pixel column
+def downsample_minmax(epochs, counts, buckets=GRAPH_WIDTH_PIXELS):
+    if len(epochs) <= 2 * buckets:
+        return epochs, counts
+    edges = np.searchsorted(epochs, np.linspace(epochs[0], epochs[-1], buckets + 1)[1:-1])
+    keep = [0, len(epochs) - 1]
+    for start, end in zip(np.r_[0, edges], np.r_[edges, len(epochs)]):
+        if end > start:
+            chunk = counts[start:end]
+            keep.append(start + int(np.argmin(chunk)))
+            keep.append(start + int(np.argmax(chunk)))
+    keep = np.unique(keep)
+    return epochs[keep], counts[keep]
+
+# Function to render the graph to PNG bytes with the object-oriented API (no pyplot global state)
+def render_graph(epochs, counts):
+    shown_epochs, shown_counts = downsample_minmax(epochs, counts)
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    # Change-only logs hold a count until the next line, so draw steps
+    marker = 'o' if len(shown_epochs) == len(epochs) else None
+    axes.plot(shown_epochs.astype('datetime64[s]'), shown_counts, marker=marker, drawstyle='steps-post')
+    axes.set_title('Agree Count Over Time')
+    axes.set_xlabel('Timestamp')
+    axes.set_ylabel('Agree Count')
+    axes.grid(True)
+    buf = io.BytesIO()
+    figure.savefig(buf, format='png')
+    return buf.getvalue()
+
 # Function to create a graph using Matplotlib
 def create_graph(dataframe):
-    plt.figure(figsize=(10, 6))
-    plt.plot(dataframe['timestamp'], dataframe['agree_count'], marker='o')
-    plt.title('Agree Count Over Time')
-    plt.xlabel('Timestamp')
-    plt.ylabel('Agree Count')
-    plt.grid(True)
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-    return buf
+    epochs = dataframe['timestamp'].values.astype('datetime64[s]').astype(np.int64)
+    return io.BytesIO(render_graph(epochs, dataframe['agree_count'].values))
+
+# Function to get the PNG for the current data; concurrent callers share a single render
+def get_graph_png():
+    global graph_cache, graph_version
+    series = read_series()
+    version = (series.file_path, series.generation, series.version)
+    if graph_version == version:
+        return graph_cache
+
+    with graph_lock:
+        if graph_version != version:
+            epochs, counts = series.arrays()
+            if not len(epochs):
+                return graph_cache
+            graph_cache = render_graph(epochs, counts)
+            graph_version = version
+        return graph_cache
 
 # Function to update the graph cache and prediction
+emitted_version = None  # Snapshot version clients were last told about
+
 def update_graph_cache_and_prediction():
-    global graph_cache, last_modified
-    file_path = 'AgreeCountLog.txt'
-    
-    current_modified = os.path.getmtime(file_path)
-    if current_modified > last_modified:
-        df = read_log_file(file_path)
-        if not df.empty:
-            graph_cache = create_graph(df)
-            last_modified = current_modified
-            latest_count = df['agree_count'].iloc[-1]
-            latest_timestamp = df['timestamp'].iloc[-1].strftime('%Y-%m-%d %H:%M:%S')
-            target_date = None
-            if latest_count < 2000000:
-                target_date = predict_target_date(df).strftime('%Y-%m-%d %H:%M:%S')
+    global emitted_version
+    series = read_series()
+
+    # Compare against what was emitted: a page request may already have consumed the refresh
+    if len(series):
+        update_aggregates(series)
+        get_graph_png()
+        snapshot = get_snapshot()
+        if snapshot['version'] != emitted_version:
+            emitted_version = snapshot['version']
             socketio.emit('update', {
-                'latest_count': str(latest_count),
-                'latest_timestamp': latest_timestamp,
-                'graph': '/graph.png',
-                'target_date': target_date
+                'latest_count': str(snapshot['latest_count']),
+                'latest_timestamp': snapshot['latest_timestamp'],
+                'graph': snapshot['graph_url'],
+                'target_date': snapshot['target_date']
             })
 
-# Background thread to periodically update the graph cache and prediction
+page_snapshot = None  # Page data for the current data version, replaced as a whole on change
+snapshot_lock = threading.Lock()
+
+# Function to get the page data, rebuilt only once per data change
+def get_snapshot():
+    global page_snapshot
+    series = read_series()
+    version = (series.file_path, series.generation, series.version)
+    snapshot = page_snapshot
+    if snapshot is not None and snapshot['version'] == version:
+        return snapshot
+
+    with snapshot_lock:
+        if page_snapshot is not None and page_snapshot['version'] == version:
+            return page_snapshot
+
+        df = series.dataframe()
+        if df.empty:
+            raise ValueError("DataFrame is empty")
+
+        latest_count = df['agree_count'].iloc[-1]
+        graph_etag = make_etag('graph', series.content_key())
+        target_date = None
+        if latest_count < PRIMARY_TARGET:
+            predicted = predict_target_dates([PRIMARY_TARGET])[PRIMARY_TARGET]
+            if predicted is not None:
+                target_date = predicted.strftime('%Y-%m-%d %H:%M:%S')
+
+        page_snapshot = {
+            'version': version,
+            'latest_count': latest_count,
+            'latest_timestamp': df['timestamp'].iloc[-1].strftime('%Y-%m-%d %H:%M:%S'),
+            'target_date': target_date,
+            'graph_etag': graph_etag,
+            'graph_url': f"/graph.png?v={graph_etag}",  # Stable per version, so caches can keep it
+            'html': None,  # Rendered by the first index() request for this version
+            'lock': threading.Lock()
+        }
+        return page_snapshot
+
+# Background thread to update the graph cache and prediction as soon as AgreeCount publishes a sample
 def background_update():
+    subscriber = open_subscriber('websitepng')
     while True:
+        if subscriber is not None:
+            subscriber.wait()  # Returns on a new sample, or after the fallback timeout
+        else:
+            time.sleep(FALLBACK_INTERVAL)
         if update_active:
             update_graph_cache_and_prediction()
-        time.sleep(1)
 
-# Function to predict when the agree count will reach 1,000,000
+PRIMARY_TARGET = 2000000  # Target shown on the page
+FORECAST_TARGETS = [1000000, 1500000, 2000000, 2500000, 3000000]  # Default targets of /api/forecast
+FORECAST_MODEL = 'recent'  # Estimator behind the page's target date
+forecasts = {
+    'recent': OnlineRegression(half_life=6 * 3600),  # Follows the current pace
+    'window': OnlineRegression(window=24 * 3600)  # Pace over the last day
+}
+
+# Function to fold new samples into the rollup tiers and the forecasts
+def update_aggregates(series):
+    update_tiers(agree_tiers, series)
+    for estimator in forecasts.values():
+        estimator.update(series)
+
+# Function to predict when each target will be reached, in O(1) from the running fit
+def predict_target_dates(targets, model=FORECAST_MODEL):
+    estimator = forecasts[model]
+    estimator.update(read_series())
+    result = {}
+    for target, epoch in estimator.predict(targets).items():
+        try:
+            result[target] = None if epoch is None else epoch_to_datetime(epoch)
+        except OverflowError:
+            result[target] = None  # The trend is too flat to get there this millennium
+    return result
+
+# Batch fit over the whole DataFrame, kept as a reference for the online estimators
 def predict_target_date(df, target=2000000):
-    df['time_diff'] = (df['timestamp'] - df['timestamp'].min()).dt.total_seconds()
-    model = np.polyfit(df['time_diff'], df['agree_count'], 1)
+    # Fit on a regular step-wise grid so bursts of changes are not over-weighted
+    epochs = df['timestamp'].values.astype('datetime64[s]').astype(np.int64)
+    step = max(60, (epochs[-1] - epochs[0]) // 10000)
+    grid, counts = resample_steps(epochs, df['agree_count'].values, step)
+    if len(grid) < 2:
+        grid, counts = epochs, df['agree_count'].values
+    time_diff = grid - epochs[0]
+    model = np.polyfit(time_diff, counts, 1)
     slope = model[0]
     intercept = model[1]
     time_needed = (target - intercept) / slope
@@ -102,10 +226,47 @@ def predict_target_date(df, target=2000000):
 def serve_image(filename):
     return send_from_directory('private', filename)
 
+RAW_CHUNK_ROWS = 10000  # Log lines formatted per streamed chunk
+
+# Function to stream samples in the AgreeCountLog.txt text format
+def log_line_chunks(epochs, counts):
+    for start in range(0, len(epochs), RAW_CHUNK_ROWS):
+        end = start + RAW_CHUNK_ROWS
+        yield format_log_lines(epochs[start:end], counts[start:end]).encode()
+
 # Send the original data on request
+# ?since= (exclusive) and ?until= (inclusive) take epoch seconds or ISO timestamps for incremental fetches
 @app.route('/raw_data')
 def serve_file():
-    return send_from_directory('.', 'AgreeCountLog.txt')
+    try:
+        since = parse_time_param(request.args.get('since'))
+        until = parse_time_param(request.args.get('until'))
+    except ValueError as e:
+        return make_response(f"Invalid since/until: {e}", 400)
+    compress = wants_gzip() and 'Range' not in request.headers
+
+    if since is None and until is None and os.path.exists(LOG_FILE_NAME):
+        if not compress:
+            # send_from_directory already handles ETag, If-None-Match and Range for the file
+            response = send_from_directory('.', LOG_FILE_NAME)
+            response.headers['Cache-Control'] = CACHE_CONTROL
+            return response
+        stat = os.stat(LOG_FILE_NAME)
+        etag = make_etag('raw_data', stat.st_ino, stat.st_size, stat.st_mtime_ns, 'gzip')
+        return conditional_response(etag, lambda: streaming_response(file_chunks(LOG_FILE_NAME), 'text/plain', compress=True))
+
+    # A time range, or only the binary log is kept: find the rows by timestamp in the same log a plain
+    # request returns and render them as text. Never the store, whose rolled-up rows are not samples.
+    series = get_series(LOG_FILE_NAME if os.path.exists(LOG_FILE_NAME) else BINARY_FILE_NAME)
+    series.refresh()
+    epochs, counts = series.arrays()
+    low = 0 if since is None else int(np.searchsorted(epochs, since, side='right'))
+    high = len(epochs) if until is None else int(np.searchsorted(epochs, until, side='right'))
+    # Copy the rows so a series rebuild cannot change them mid-stream
+    epochs = epochs[low:high].copy()
+    counts = counts[low:high].copy()
+    etag = make_etag('raw_data', series.content_key(), since, until, compress)
+    return conditional_response(etag, lambda: streaming_response(log_line_chunks(epochs, counts), 'text/plain', compress))
 
 # Update History
 @app.route('/update-history')
@@ -115,20 +276,16 @@ def update_history():
 # Route for serving the graph image
 @app.route('/graph.png')
 def graph_png():
-    global graph_cache
-    if graph_cache is None:
-        update_graph_cache_and_prediction()
-    return send_file(io.BytesIO(graph_cache.getvalue()), mimetype='image/png')
+    etag = make_etag('graph', read_series().content_key())
+    png = get_graph_png()
+    if png is None:
+        return make_response("No data available", 503)
+    return conditional_response(etag, lambda: send_file(io.BytesIO(png), mimetype='image/png', etag=False))
 
 def read_data_from_file(filename):
     with open(filename, 'r') as file:
         return file.readlines()
 
-cache = {
-    'data': None,
-    'timestamp': 0
-}
-cache_lock = threading.Lock()
 # Initialize rate limiter
 limiter = Limiter(
     get_remote_address,
@@ -136,35 +293,88 @@ limiter = Limiter(
     default_limits=["5000 per minute", "200000 per hour"]
 )
 
-# Initialize cache
-cache = TTLCache(maxsize=1000, ttl=60)
-
-# ... (rest of the original code remains the same)
-
-# Caching decorator
-def cached(timeout=60):
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            cache_key = f.__name__ + str(args) + str(kwargs)
-            cached_result = cache.get(cache_key)
-            if cached_result is not None:
-                return cached_result
-            result = f(*args, **kwargs)
-            cache[cache_key] = result
-            return result
-        return decorated_function
-    return decorator
+# Initialize cache; entries are keyed on the log's content, so new samples invalidate them at once
+cache = VersionedCache(maxsize=1000)
+
+def data_version():
+    return read_series().content_key()
+
+# Hit/miss counters of the response cache
+@app.route('/api/cache-stats')
+def cache_stats():
+    return jsonify(cache.stats())
 
 # Modified route with caching and rate limiting
 @app.route('/api/1_hour_update/json')
 @app.route('/api/1h-update/json')
 @limiter.limit("5000 per minute")
-@cached(timeout=60)
 def hourly_update():
-    current_time = time.time()
-    
-    data = read_data_from_file('AgreeCountLog.txt')
+    etag = make_etag('hourly', data_version())
+    return conditional_response(etag, build_hourly_update)
+
+agree_tiers = make_tiers(fill_gaps=True)  # 1m..1d rollups, only the newest bucket of each is ever recomputed
+
+@cached(cache, data_version, etag=lambda version: make_etag('hourly', version))
+def build_hourly_update():
+    hourly_rollup = agree_tiers['1h']
+    hourly_rollup.update(read_series())
+    rows = hourly_rollup.rows()
+
+    result = []
+    for (hour, _, count, *_), (_, _, next_count, *_) in zip(rows[:-2], rows[1:-1]):  # Exclude the last hour
+        result.append({
+            'hour': epoch_to_datetime(hour + 3600).isoformat(),  # Shift to +1 hour
+            'count': count,
+            'joined': next_count - count
+        })
+
+    return jsonify(result)
+
+# Aggregates (first, last, min, max, delta) per bucket of 1m, 5m, 15m, 1h or 1d
+@app.route('/api/buckets')
+@limiter.limit("5000 per minute")
+def buckets():
+    try:
+        bucket, start, end = parse_bucket_query(request.args)
+    except ValueError as e:
+        return make_response(jsonify({'error': str(e)}), 400)
+
+    series = read_series()
+    version = series.content_key()
+    def build():
+        rollup = agree_tiers[bucket]
+        rollup.update(series)
+        return jsonify({'series': 'agree', 'bucket': bucket, 'rows': rollup.aggregate(start, end)})
+    def etag(served):
+        return make_etag('buckets', served, bucket, start, end)
+    return conditional_response(etag(version), lambda: cache.response(('buckets', bucket, start, end), version, build, etag))
+
+# Predicted dates for several targets at once
+@app.route('/api/forecast')
+@limiter.limit("5000 per minute")
+def forecast():
+    model = request.args.get('model', FORECAST_MODEL)
+    if model not in forecasts:
+        return make_response(jsonify({'error': f"model must be one of {', '.join(forecasts)}"}), 400)
+    try:
+        targets = [int(target) for target in request.args.get('targets', '').split(',') if target] or FORECAST_TARGETS
+    except ValueError:
+        return make_response(jsonify({'error': "targets must be comma-separated integers"}), 400)
+
+    version = data_version()
+    def build():
+        dates = predict_target_dates(targets, model)
+        return jsonify({
+            'model': model,
+            'targets': {str(target): None if date is None else date.isoformat() for target, date in dates.items()}
+        })
+    def etag(served):
+        return make_etag('forecast', served, model, targets)
+    return conditional_response(etag(version), lambda: cache.response(('forecast', model, tuple(targets)), version, build, etag))
+
+# Full re-scan of the text log, kept to verify the incremental rollup against
+def hourly_update_full_scan(file_path='AgreeCountLog.txt'):
+    data = read_data_from_file(file_path)
     hourly_data = {}
     
     for entry in data:
@@ -186,6 +396,15 @@ def hourly_update():
         # Always update the count, this will keep the latest count for each hour
         hourly_data[hour_key] = count
     
+    # Hours without a line kept the previous count (change-only log)
+    if hourly_data:
+        hour = min(hourly_data)
+        last_hour = max(hourly_data)
+        previous_count = hourly_data[hour]
+        while hour < last_hour:
+            hour += timedelta(hours=1)
+            previous_count = hourly_data.setdefault(hour, previous_count)
+
     # Sort the hours
     sorted_hours = sorted(hourly_data.keys())
     
@@ -202,7 +421,7 @@ def hourly_update():
             'joined': joined
         })
     
-    return jsonify(result)
+    return result
 
 # Route for the main page
 @app.route('/')
@@ -210,23 +429,8 @@ def index():
     try:
         app.logger.info("Loading index page")
 
-        # Path to your log file
-        file_path = 'AgreeCountLog.txt'
-
-        # Read the log file and create the DataFrame
-        df = read_log_file(file_path)
-
-        if df.empty:
-            raise ValueError("DataFrame is empty")
-
-        # Get the latest count and timestamp
-        latest_count = df['agree_count'].iloc[-1] if not df.empty else 'No data available'
-        latest_timestamp = df['timestamp'].iloc[-1].strftime('%Y-%m-%d %H:%M:%S') if not df.empty else 'No data available'
-
-        # Predict the date when the count will reach 1,000,000
-        target_date = None
-        if latest_count < 2000000:
-            target_date = predict_target_date(df).strftime('%Y-%m-%d %H:%M:%S')
+        # Latest count, timestamp and prediction, computed once per data change
+        snapshot = get_snapshot()
 
         # HTML template to display the graph and the latest count
         html_template = '''
@@ -360,7 +564,7 @@ def index():
                             var newCount = parseInt(data.latest_count);
                             animateValue(latestCountElement, currentCount, newCount, 1000);
                             document.getElementById('latest-timestamp').textContent = data.latest_timestamp;
-                            document.getElementById('graph-image').src = data.graph + '?t=' + data.latest_timestamp;
+                            document.getElementById('graph-image').src = data.graph;
                             if (data.target_date) {
                                 document.getElementById('target-date').style.display = 'block';
                                 document.getElementById('target-date').textContent = '200만 예상일시: ' + data.target_date;
@@ -400,7 +604,7 @@ def index():
                     <small>기준일시: <span id="latest-timestamp">{{ latest_timestamp }}</span></small>
                 </div>
                 <div id="target-date" class="target-date"></div>
-                <img id="graph-image" src="{{ url_for('graph_png') }}?t={{ latest_timestamp }}" alt="Agree Count Graph">
+                <img id="graph-image" src="{{ url_for('graph_png', v=graph_etag) }}" alt="Agree Count Graph">
                 <div>
                     <strong>Users Online (Image): <span id="user-count">0</span></strong> | <a href="https://petitions-agreecount-01.fediverses.kr/raw_data">평문데이터 보기</a>
                 </div>
@@ -414,9 +618,14 @@ def index():
         </html>
         '''
 
+        # Render once per data change and serve the same HTML until the next one
+        with snapshot['lock']:
+            if snapshot['html'] is None:
+                snapshot['html'] = render_template_string(html_template, latest_count=snapshot['latest_count'], latest_timestamp=snapshot['latest_timestamp'], target_date=snapshot['target_date'], graph_etag=snapshot['graph_etag'])
+
         app.logger.info("Index page loaded successfully")
 
-        return render_template_string(html_template, latest_count=latest_count, latest_timestamp=latest_timestamp, target_date=target_date)
+        return snapshot['html']
     except Exception as e:
         app.logger.error(f"Error loading index: {e}")
         return make_response(f"Error loading page: {e}", 500)
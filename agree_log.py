@@ -0,0 +1,367 @@
+import os
+import struct
+import threading
+import numpy as np
+import pandas as pd
+from series_store import AGREE_SERIES, STORE_FILE_NAME, open_store, store_exists
+
+LOG_FILE_NAME = 'AgreeCountLog.txt'
+BINARY_FILE_NAME = 'AgreeCountLog.bin'
+# Fixed-width binary record: epoch seconds (naive local time) and count, little endian
+RECORD_DTYPE = np.dtype([('epoch', '<i8'), ('count', '<i8')])
+RECORD_FORMAT = struct.Struct('<qq')
+LOG_SEPARATOR = ': Agree Count = '
+HEAD_SIGNATURE_BYTES = 64  # Bytes compared to detect a rewritten log file
+INITIAL_CAPACITY = 1024
+
+# Function to parse log lines into epoch seconds and counts (naive local time)
+def parse_log_lines(lines):
+    stamps = []
+    counts = []
+    for line in lines:
+        parts = line.split(LOG_SEPARATOR)
+        if len(parts) != 2:
+            continue
+        stamps.append(parts[0].strip())
+        counts.append(parts[1].strip())
+    if not stamps:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    try:
+        epochs = np.array(stamps, dtype='datetime64[s]').astype(np.int64)
+        values = np.array(counts).astype(np.int64)
+        return epochs, values
+    except ValueError:
+        pass
+
+    # Slow path: skip the malformed lines one by one
+    good_epochs = []
+    good_values = []
+    for stamp, count in zip(stamps, counts):
+        try:
+            epoch = np.datetime64(stamp, 's').astype(np.int64)
+            value = int(count)
+        except ValueError:
+            continue
+        good_epochs.append(epoch)
+        good_values.append(value)
+    return np.array(good_epochs, dtype=np.int64), np.array(good_values, dtype=np.int64)
+
+# In-memory copy of AgreeCountLog.txt that only parses newly appended lines
+class AgreeLogSeries:
+    def __init__(self, file_path=LOG_FILE_NAME):
+        self.file_path = file_path
+        self.version = 0  # Bumped whenever the series changes
+        self.generation = 0  # Bumped whenever the series is rebuilt from scratch
+        self._lock = threading.RLock()
+        self._epochs = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self._counts = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self._size = 0
+        self._offset = 0
+        self._inode = None
+        self._mtime = None
+        self._head = b''
+        self._frame = None
+        self._frame_version = -1
+
+    def __len__(self):
+        return self._size
+
+    def _reset(self):
+        self._size = 0
+        self._offset = 0
+        self._head = b''
+        self._inode = None
+        self._mtime = None
+        self.generation += 1
+        self.version += 1
+
+    def _append(self, epochs, counts):
+        needed = self._size + len(epochs)
+        if needed > len(self._epochs):
+            capacity = max(needed, len(self._epochs) * 2)
+            self._epochs = np.resize(self._epochs, capacity)
+            self._counts = np.resize(self._counts, capacity)
+        self._epochs[self._size:needed] = epochs
+        self._counts[self._size:needed] = counts
+        self._size = needed
+
+    def _was_rewritten(self, file, stat):
+        if self._inode is not None and stat.st_ino != self._inode:
+            return True
+        if stat.st_size < self._offset:
+            return True
+        if self._head:
+            file.seek(0)
+            if file.read(len(self._head)) != self._head:
+                return True
+        return False
+
+    # Read whatever was appended since the last call; returns True if the series changed
+    def refresh(self):
+        with self._lock:
+            try:
+                stat = os.stat(self.file_path)
+            except FileNotFoundError:
+                if self._size or self._offset:
+                    self._reset()
+                    return True
+                return False
+
+            if (stat.st_ino == self._inode and stat.st_mtime_ns == self._mtime
+                    and stat.st_size == self._offset):
+                return False
+
+            changed = False
+            with open(self.file_path, 'rb') as file:
+                if self._was_rewritten(file, stat):
+                    # AgreeCount trimmed or replaced the log, start over
+                    self._reset()
+                    changed = True
+                file.seek(self._offset)
+                chunk = file.read()
+
+            self._inode = stat.st_ino
+            self._mtime = stat.st_mtime_ns
+            end = chunk.rfind(b'\n') + 1  # Leave a partially written line for next time
+            if end == 0:
+                return changed
+            if self._offset == 0:
+                self._head = chunk[:min(end, HEAD_SIGNATURE_BYTES)]
+            elif len(self._head) < HEAD_SIGNATURE_BYTES:
+                self._head += chunk[:min(end, HEAD_SIGNATURE_BYTES - len(self._head))]
+            self._offset += end
+
+            lines = chunk[:end].decode('utf-8', errors='replace').splitlines()
+            epochs, counts = parse_log_lines(lines)
+            if len(epochs):
+                self._append(epochs, counts)
+                changed = True
+            if changed:
+                self.version += 1
+            return changed
+
+    # Identifies the file contents read so far; stable across processes and restarts
+    def content_key(self):
+        with self._lock:
+            return (self.file_path, self._inode, self._offset)
+
+    # Generation and column views taken together, for consumers that track how far they have read
+    def view(self):
+        with self._lock:
+            epochs, counts = self.arrays()
+            return self.generation, epochs, counts
+
+    # Views of the parsed columns; callers must not modify them
+    def arrays(self):
+        with self._lock:
+            return self._epochs[:self._size], self._counts[:self._size]
+
+    def latest(self):
+        with self._lock:
+            epochs, counts = self.arrays()
+            if not len(epochs):
+                return None
+            return int(epochs[-1]), int(counts[-1])
+
+    # DataFrame with 'timestamp' and 'agree_count', built once per version (treat as read-only)
+    def dataframe(self):
+        with self._lock:
+            if self._frame_version != self.version:
+                epochs, counts = self.arrays()
+                self._frame = pd.DataFrame({
+                    'timestamp': pd.to_datetime(epochs, unit='s'),
+                    'agree_count': counts.copy(),
+                })
+                self._frame_version = self.version
+            return self._frame
+
+# Function to rebuild a regular step-wise series from change-only samples
+def resample_steps(epochs, counts, step, start=None, end=None):
+    if not len(epochs):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    start = epochs[0] if start is None else start
+    end = epochs[-1] if end is None else end
+    grid = np.arange(start, end + 1, step, dtype=np.int64)
+    # Each grid point takes the last count recorded at or before it
+    index = np.searchsorted(epochs, grid, side='right') - 1
+    valid = index >= 0
+    return grid[valid], counts[index[valid]]
+
+# Same interface as AgreeLogSeries, backed by a zero-copy memmap of AgreeCountLog.bin
+class AgreeBinarySeries(AgreeLogSeries):
+    def __init__(self, file_path=BINARY_FILE_NAME):
+        super().__init__(file_path)
+        self._records = None
+
+    def __len__(self):
+        return 0 if self._records is None else len(self._records)
+
+    def _reset(self):
+        self._records = None
+        self._inode = None
+        self.generation += 1
+        self.version += 1
+
+    def refresh(self):
+        with self._lock:
+            try:
+                stat = os.stat(self.file_path)
+            except FileNotFoundError:
+                if self._records is not None:
+                    self._reset()
+                    return True
+                return False
+
+            known = len(self)
+            total = stat.st_size // RECORD_DTYPE.itemsize  # Ignore a partially written record
+            changed = False
+            if (self._inode is not None and stat.st_ino != self._inode) or total < known:
+                self._reset()
+                known = 0
+                changed = True
+            self._inode = stat.st_ino
+            if total == known:
+                return changed
+
+            self._records = np.memmap(self.file_path, dtype=RECORD_DTYPE, mode='r', shape=(total,))
+            self.version += 1
+            return True
+
+    def content_key(self):
+        with self._lock:
+            return (self.file_path, self._inode, len(self))
+
+    def arrays(self):
+        with self._lock:
+            if self._records is None:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+            return self._records['epoch'], self._records['count']
+
+# Same interface as AgreeLogSeries, backed by the agree series of the shared SQLite store
+class AgreeStoreSeries(AgreeLogSeries):
+    def __init__(self, file_path=STORE_FILE_NAME, series=AGREE_SERIES):
+        super().__init__(file_path)
+        self.series = series
+        self._store_version = None
+
+    def _reset(self):
+        self._size = 0
+        self._store_version = None
+        self.generation += 1
+        self.version += 1
+
+    # Function to check that the newest sample held in memory still reads the same from the store
+    def _tail_matches(self, store):
+        last = int(self._epochs[self._size - 1])
+        epochs, counts = store.range(self.series, since=last - 1, until=last)
+        return len(epochs) > 0 and epochs[-1] == last and counts[-1] == self._counts[self._size - 1]
+
+    def refresh(self):
+        with self._lock:
+            if not os.path.exists(self.file_path):
+                if self._size:
+                    self._reset()
+                    return True
+                return False
+
+            store = open_store(self.file_path)
+            store_version = store.version(self.series)
+            if store_version == self._store_version:
+                return False
+
+            changed = False
+            first, last, compactions = store_version
+            if self._size and compactions != self._store_version[2]:
+                # A retention pass only folds samples older than RAW_RETENTION, so the copy stays
+                # valid (and keeps their full detail) as long as its newest sample is still there
+                if not self._tail_matches(store):
+                    self._reset()
+                    changed = True
+            elif self._size and (first != self._store_version[0] or last < self._epochs[self._size - 1]):
+                # The store was replaced, start over
+                self._reset()
+                changed = True
+            since = int(self._epochs[self._size - 1]) if self._size else None
+            epochs, counts = store.range(self.series, since=since)
+            if len(epochs):
+                self._append(epochs, counts)
+                changed = True
+            self._store_version = store_version
+            if changed:
+                self.version += 1
+            return changed
+
+    def content_key(self):
+        with self._lock:
+            return (self.file_path, self.series, self._store_version, self._size)
+
+# Function to append one sample to the binary log
+def append_binary_record(epoch, count, file_path=BINARY_FILE_NAME):
+    with open(file_path, 'ab') as file:
+        file.write(RECORD_FORMAT.pack(epoch, count))
+
+# Function to load the binary log as a read-only structured array view
+def load_binary_log(file_path=BINARY_FILE_NAME):
+    total = os.path.getsize(file_path) // RECORD_DTYPE.itemsize
+    if not total:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(file_path, dtype=RECORD_DTYPE, mode='r', shape=(total,))
+
+# Function to write records to the binary log through a temp file and an atomic rename
+def write_binary_log(epochs, counts, file_path=BINARY_FILE_NAME):
+    records = np.empty(len(epochs), dtype=RECORD_DTYPE)
+    records['epoch'] = epochs
+    records['count'] = counts
+    temp_file_path = file_path + '.tmp'
+    with open(temp_file_path, 'wb') as file:
+        file.write(records.tobytes())
+    os.replace(temp_file_path, file_path)
+
+# Function to convert an AgreeCountLog.txt style log into the binary format
+def convert_text_log(text_path=LOG_FILE_NAME, binary_path=BINARY_FILE_NAME):
+    with open(text_path, 'r') as file:
+        epochs, counts = parse_log_lines(file)
+    write_binary_log(epochs, counts, binary_path)
+    return len(epochs)
+
+# Function to render samples back into the AgreeCountLog.txt text format
+def format_log_lines(epochs, counts):
+    stamps = np.asarray(epochs, dtype=np.int64).astype('datetime64[s]').astype(str)
+    return ''.join(f"{stamp.replace('T', ' ')}{LOG_SEPARATOR}{count}\n" for stamp, count in zip(stamps, counts))
+
+series_registry = {}
+registry_lock = threading.Lock()
+
+# Function to get the shared series for a log file
+def get_series(file_path=LOG_FILE_NAME):
+    with registry_lock:
+        series = series_registry.get(file_path)
+        if series is None:
+            if file_path.endswith('.db'):
+                series = AgreeStoreSeries(file_path)
+            elif file_path.endswith('.bin'):
+                series = AgreeBinarySeries(file_path)
+            else:
+                series = AgreeLogSeries(file_path)
+            series_registry[file_path] = series
+        return series
+
+store_ready = False  # Set once the store holds agree samples; retention never removes them all
+
+# Function to pick the log readers should use: the shared store once AgreeCount has filled it
+# (check_waiting may create the file first), else the binary log once AgreeCount writes it
+def default_log_path():
+    global store_ready
+    if not store_exists(STORE_FILE_NAME):
+        store_ready = False
+    elif not store_ready:
+        store_ready = not open_store(STORE_FILE_NAME).is_empty(AGREE_SERIES)
+    if store_ready:
+        return STORE_FILE_NAME
+    if os.path.exists(BINARY_FILE_NAME):
+        return BINARY_FILE_NAME
+    return LOG_FILE_NAME
+
+if __name__ == '__main__':
+    converted = convert_text_log()
+    print(f"Converted {converted} entries from {LOG_FILE_NAME} to {BINARY_FILE_NAME}")
@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+SIZES = {'10k': 10000, '80k': 80000, '1m': 1000000}
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(SCRIPT_DIR, 'bench_baseline.json')
+OUTPUT_FILE = os.path.join(SCRIPT_DIR, 'bench_output.txt')
+REPEAT = 3  # timed runs per case; the fastest one is reported
+REGRESSION_THRESHOLD = 1.2  # flag cases more than 20% slower than the baseline
+START_EPOCH = 1719792000  # 2024-07-01 00:00:00, naive local time like the real logs
+STORE_DIR = 'store'  # per-size subdirectory holding only petition_series.db, for the store cases
+
+sys.path.insert(0, SCRIPT_DIR)
+
+# Function to write an AgreeCountLog.txt with a realistic change-only cadence and growth
+def generate_agree_log(file_path, rows, seed=1):
+    from agree_log import format_log_lines
+    rng = np.random.default_rng(seed)
+    # Polls every 3 s while busy, up to 30 s when quiet; surges come in bursts
+    epochs = START_EPOCH + np.cumsum(rng.integers(3, 31, rows))
+    surge = rng.random(rows) < 0.05
+    counts = 100000 + np.cumsum(rng.poisson(np.where(surge, 200, 8)) + 1)
+    with open(file_path, 'w') as file:
+        for start in range(0, rows, 100000):
+            file.write(format_log_lines(epochs[start:start + 100000], counts[start:start + 100000]))
+
+# Function to write a wait_times.json with one sample per 14 s
+def generate_wait_times(file_path, rows, seed=2):
+    from wait_store import to_time_strings
+    rng = np.random.default_rng(seed)
+    epochs = START_EPOCH + 14 * np.arange(rows)
+    waits = np.abs(np.cumsum(rng.normal(0, 300, rows))).astype(np.int64)
+    with open(file_path, 'w') as file:
+        json.dump([[stamp, wait] for stamp, wait in zip(to_time_strings(epochs), waits.tolist())], file)
+
+# Function to create the fixtures for one size, reusing them when they are already there
+def prepare_fixtures(data_dir, size, rows):
+    size_dir = os.path.join(data_dir, size)
+    os.makedirs(size_dir, exist_ok=True)
+    if not os.path.exists(os.path.join(size_dir, 'AgreeCountLog.txt')):
+        generate_agree_log(os.path.join(size_dir, 'AgreeCountLog.txt'), rows)
+    if not os.path.exists(os.path.join(size_dir, 'wait_times.json')):
+        generate_wait_times(os.path.join(size_dir, 'wait_times.json'), rows)
+    prepare_store(size_dir)
+    return size_dir
+
+# Function to import the agree log into a store with retention applied, as AgreeCount leaves it
+def prepare_store(size_dir):
+    from agree_log import parse_log_lines
+    from series_store import AGREE_SERIES, STORE_FILE_NAME, open_store
+    os.makedirs(os.path.join(size_dir, STORE_DIR), exist_ok=True)
+    store = open_store(os.path.join(size_dir, STORE_DIR, STORE_FILE_NAME))
+    if store.is_empty(AGREE_SERIES):
+        with open(os.path.join(size_dir, 'AgreeCountLog.txt'), 'r') as file:
+            epochs, counts = parse_log_lines(file)
+        store.append_many(AGREE_SERIES, epochs, counts)
+        store.apply_retention(AGREE_SERIES, int(epochs[-1]))
+
+# Function to import the services without letting check_waiting poll the real upstream
+def import_services(scratch_dir):
+    previous_dir = os.getcwd()
+    os.chdir(scratch_dir)
+    try:
+        # A fresh sample makes check_waiting's poller wait 14 s before its first fetch,
+        # long enough to push its next fetch out of reach below
+        with open('wait_times.json', 'w') as file:
+            json.dump([[datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 0]], file)
+        import WebsitePNG
+        import Website
+        import check_waiting
+        import Graph_over_time
+        check_waiting.cache_time = datetime.max
+    finally:
+        os.chdir(previous_dir)
+    return WebsitePNG, Website, check_waiting, Graph_over_time
+
+# Function to time run() after setup(); returns (seconds, peak bytes, payload bytes)
+def measure(setup, run, repeat=REPEAT):
+    best = None
+    payload = None
+    for _ in range(repeat):
+        state = setup()
+        started = time.perf_counter()
+        payload = run(state)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    # A separate traced run, tracemalloc slows the code down too much to time it
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, payload
+
+# Function to list the benchmark cases: name -> (directory under the size's fixtures, setup,
+# run returning the payload size or None)
+def make_cases(WebsitePNG, Website, check_waiting, Graph_over_time):
+    import agree_log
+    import series_store
+    from http_cache import VersionedCache
+    from rollups import make_tiers
+    from wait_store import load_wait_history
+
+    def fresh_series():
+        agree_log.series_registry.clear()  # Next read parses the whole log again
+
+    def fresh_store():
+        fresh_series()
+        series_store.store_registry.clear()  # Connections keep the file they were opened on
+        agree_log.store_ready = False
+
+    def parsed_frame():
+        fresh_series()
+        return WebsitePNG.read_log_file('AgreeCountLog.txt')
+
+    def cold_hourly():
+        parsed_frame()
+        WebsitePNG.cache.clear()
+        WebsitePNG.agree_tiers = make_tiers(fill_gaps=True)
+        return WebsitePNG.app.test_client()
+
+    def cold_store_hourly():
+        fresh_store()
+        WebsitePNG.cache.clear()
+        WebsitePNG.agree_tiers = make_tiers(fill_gaps=True)
+        return WebsitePNG.app.test_client()
+
+    def read_store(_):
+        WebsitePNG.read_series()
+
+    def read_log(_):
+        WebsitePNG.read_log_file('AgreeCountLog.txt')
+
+    def predict(df):
+        WebsitePNG.predict_target_date(df)
+
+    def plotly_json(df):
+        return len(Website.create_graph(df).to_json())
+
+    def loaded_history():
+        times, _, waits = load_wait_history('wait_times.json', check_waiting.MAX_WAIT_ENTRIES)
+        check_waiting.history.clear()
+        check_waiting.history.extend(zip(times, waits.tolist()))
+
+    def published():
+        loaded_history()
+        check_waiting.publish_snapshot(len(check_waiting.history))
+        return check_waiting.app.test_client()
+
+    def cold_plot():
+        fresh_series()
+        Graph_over_time.plot_cache = VersionedCache(maxsize=4)
+        return Graph_over_time.app.test_client()
+
+    return {
+        'WebsitePNG.read_log_file': ('.', fresh_series, read_log),
+        'WebsitePNG.read_series[store]': (STORE_DIR, fresh_store, read_store),
+        'WebsitePNG.hourly_update': ('.', cold_hourly, lambda client: len(client.get('/api/1_hour_update/json').data)),
+        'WebsitePNG.hourly_update[store]': (STORE_DIR, cold_store_hourly, lambda client: len(client.get('/api/1_hour_update/json').data)),
+        'WebsitePNG.create_graph': ('.', parsed_frame, lambda df: WebsitePNG.create_graph(df).getbuffer().nbytes),
+        'WebsitePNG.predict_target_date': ('.', parsed_frame, predict),
+        'Website.create_graph+to_json': ('.', parsed_frame, plotly_json),
+        'check_waiting.publish_snapshot': ('.', loaded_history, lambda _: len(check_waiting.publish_snapshot(len(check_waiting.history))['initial_gzip'])),
+        'check_waiting.initial_data': ('.', published, lambda client: len(client.get('/initial-data').data)),
+        'Graph_over_time.plot_data': ('.', cold_plot, lambda client: len(client.get('/plot-data').data)),
+    }
+
+# Function to check the incremental hourly rollup against the full re-scan of the log
+def verify_hourly(WebsitePNG):
+    from rollups import make_tiers
+    import agree_log
+    agree_log.series_registry.clear()
+    WebsitePNG.cache.clear()
+    WebsitePNG.agree_tiers = make_tiers(fill_gaps=True)
+    rollup = WebsitePNG.app.test_client().get('/api/1_hour_update/json').get_json()
+    return rollup == WebsitePNG.hourly_update_full_scan('AgreeCountLog.txt')
+
+# Function to format the byte counts in the report
+def format_bytes(value):
+    if value is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB'):
+        if value < 1024:
+            return f"{value:.0f}{unit}"
+        value /= 1024
+    return f"{value:.1f}GB"
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the petition services')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--data-dir', help='where fixtures are generated and reused (default: a temp dir)')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--save-baseline', action='store_true', help=f'store the results in {BASELINE_FILE}')
+    parser.add_argument('--verify', action='store_true', help='check the hourly rollup against hourly_update_full_scan')
+    args = parser.parse_args()
+
+    data_dir = os.path.abspath(args.data_dir or tempfile.mkdtemp(prefix='agreecount-bench-'))
+    scratch_dir = os.path.join(data_dir, 'scratch')
+    os.makedirs(scratch_dir, exist_ok=True)
+    services = import_services(scratch_dir)
+    cases = make_cases(*services)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as file:
+            baseline = json.load(file)
+
+    results = {}
+    lines = [f"Benchmark {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, fixtures in {data_dir}",
+             f"{'case':<34}{'size':>6}{'time':>11}{'baseline':>11}{'peak mem':>10}{'payload':>10}"]
+    print('\n'.join(lines))
+    original_dir = os.getcwd()
+    try:
+        for size in args.sizes:
+            size_dir = prepare_fixtures(data_dir, size, SIZES[size])
+            for name, (where, setup, run) in cases.items():
+                os.chdir(os.path.join(size_dir, where))
+                key = f"{name}@{size}"
+                seconds, peak, payload = measure(setup, run, args.repeat)
+                results[key] = {'seconds': seconds, 'peak_bytes': peak, 'payload_bytes': payload}
+
+                previous = baseline.get(key)
+                compared = '-'
+                flag = ''
+                if previous:
+                    compared = f"{previous['seconds'] * 1000:.1f}ms"
+                    if seconds > previous['seconds'] * REGRESSION_THRESHOLD:
+                        flag = '  SLOWER'
+                    elif seconds * REGRESSION_THRESHOLD < previous['seconds']:
+                        flag = '  faster'
+                line = (f"{name:<34}{size:>6}{seconds * 1000:>9.1f}ms{compared:>11}"
+                        f"{format_bytes(peak):>10}{format_bytes(payload):>10}{flag}")
+                print(line)
+                lines.append(line)
+
+            if args.verify:
+                os.chdir(size_dir)
+                line = f"hourly rollup vs full scan @{size}: {'OK' if verify_hourly(services[0]) else 'MISMATCH'}"
+                print(line)
+                lines.append(line)
+    finally:
+        os.chdir(original_dir)
+
+    with open(OUTPUT_FILE, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    if args.save_baseline:
+        baseline.update(results)
+        with open(BASELINE_FILE, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Saved baseline to {BASELINE_FILE}")
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,20 @@
 import requests
 import time
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, render_template
+from flask import Flask, jsonify, render_template, request, make_response
 from flask_cors import CORS
 import threading
 import json
 import os
+import bisect
+from collections import deque
 from flask_socketio import SocketIO, emit
 import logging
+import numpy as np
+from http_cache import NO_CACHE, conditional_response, encoded_response, gzip_bytes, make_etag, streaming_response, wants_gzip
+from rollups import epoch_to_datetime, make_tiers, parse_bucket_query, parse_time_param
+from series_store import STORE_FILE_NAME, WAIT_SERIES, open_store, store_exists
+from wait_store import WaitJournal, journal_path, load_wait_history, to_epochs, to_time_strings
 
 app = Flask(__name__)
 CORS(app)
@@ -20,22 +27,84 @@ log = logging.getLogger('werkzeug')
 log.setLevel(logging.WARNING)
 
 data_file = 'wait_times.json'
+MAX_WAIT_ENTRIES = 50000
+TIMEOUT = 10  # seconds to wait for NetFunnel before giving up on this sample
+WRITE_STORE = True  # Also store each sample in the shared STORE_FILE_NAME database
 
+history = deque(maxlen=MAX_WAIT_ENTRIES)  # Writer-side ring buffer, the oldest entry drops off in O(1)
+
+# Immutable snapshot of the current state. update_wait_times builds a new one per sample and swaps
+# it in, so a request reads `cache` once and never waits on the fetch or the file write.
 cache = {
-    'wait_times': [],
+    'wait_times': (),
     'latest_timestamp': None,
-    'latest_count': 0
+    'latest_count': 0,
+    'seq': 0,  # Entries appended since start; clients use it to spot missed updates
+    'stream': f"{os.getpid()}-{int(time.time())}"  # Changes on restart, when seq starts over
 }
 cache_time = None
-cache_lock = threading.Lock()
+cache_lock = threading.Lock()  # Held only while a new snapshot and the rollups are published
+journal = WaitJournal(data_file)  # Samples are appended here and folded into data_file periodically
+wait_tiers = make_tiers()  # Wait counts per 1m..1d bucket, kept up to date as samples arrive; gaps stay empty
+
+def add_to_tiers(epochs, waits):
+    for rollup in wait_tiers.values():
+        rollup.add_samples(epochs, waits)
+
+# Function to pick the samples the tiers start from: the store's full history, where older
+# stretches read as rollups, plus any loaded samples newer than its last row
+def tier_history(epochs, waits):
+    if not store_exists(STORE_FILE_NAME):
+        return epochs, waits
+    stored_epochs, stored_waits = open_store(STORE_FILE_NAME).range(WAIT_SERIES)
+    if not len(stored_epochs):
+        return epochs, waits
+    newer = epochs > stored_epochs[-1]
+    return np.concatenate([stored_epochs, epochs[newer]]), np.concatenate([stored_waits, waits[newer]])
 
-if os.path.exists(data_file):
-    with open(data_file, 'r') as file:
-        cache['wait_times'] = json.load(file)
-        if cache['wait_times']:
-            cache['latest_timestamp'] = cache['wait_times'][-1][0]
-            cache['latest_count'] = cache['wait_times'][-1][1]
-            cache_time = datetime.now()
+# Function to encode a value the way jsonify does, for bodies built ahead of the requests
+def json_bytes(value):
+    return json.dumps(value, separators=(',', ':')).encode()
+
+# Function to swap in a new snapshot of history; readers still holding the old one are unaffected.
+# The /initial-data and /latest-data bodies are encoded here, once per sample, not per request.
+def publish_snapshot(seq):
+    global cache
+    wait_times = tuple(history)
+    latest = wait_times[-1] if wait_times else (None, 0)
+    initial_json = json_bytes({
+        'stream': cache['stream'],
+        'seq': seq,
+        'latest_count': latest[1],
+        'latest_timestamp': latest[0],
+        'times': [wt[0] for wt in wait_times],
+        'waits': [wt[1] for wt in wait_times]
+    })
+    latest_json = json_bytes([[latest[0] or "", latest[1]]])
+    cache = {
+        'wait_times': wait_times,
+        'latest_timestamp': latest[0],
+        'latest_count': latest[1],
+        'seq': seq,
+        'stream': cache['stream'],
+        'initial_json': initial_json,
+        'initial_gzip': gzip_bytes(initial_json),
+        'latest_json': latest_json,
+        'latest_gzip': gzip_bytes(latest_json)
+    }
+    return cache
+
+# Memory-maps wait_times.npy when it is current, so a restart skips decoding the JSON
+loaded_times, loaded_epochs, loaded_waits = load_wait_history(data_file, MAX_WAIT_ENTRIES)
+history.extend(zip(loaded_times, loaded_waits.tolist()))
+if history:
+    cache_time = datetime.now()
+publish_snapshot(len(history))
+if os.path.exists(journal_path(data_file)) and os.path.getsize(journal_path(data_file)):
+    journal.compact(history)  # Fold the replayed journal into the snapshot and start a clean one
+if WRITE_STORE and len(loaded_epochs) and open_store(STORE_FILE_NAME).is_empty(WAIT_SERIES):
+    open_store(STORE_FILE_NAME).append_many(WAIT_SERIES, loaded_epochs, loaded_waits)
+add_to_tiers(*tier_history(loaded_epochs, loaded_waits))
 
 connected_users = 0
 
@@ -47,56 +116,59 @@ def extract_nwait(response_text):
     except (IndexError, ValueError):
         return None
 
+# Function to journal a sample, compacting into wait_times.json every so often; a failed
+# compaction leaves the journal in place and is retried on the next sample
+def save_wait_time(entry, wait_times):
+    try:
+        if journal.append(entry):
+            journal.compact(wait_times)
+    except Exception as e:
+        print(f"Error saving to file: {e}")
+
+    if WRITE_STORE:
+        try:
+            store = open_store(STORE_FILE_NAME)
+            store.append(WAIT_SERIES, to_epochs([entry[0]])[0], entry[1])
+            store.maybe_apply_retention(WAIT_SERIES)
+        except Exception as e:
+            print(f"Error writing to {STORE_FILE_NAME}: {e}")
+
 def update_wait_times():
     global cache_time
     while True:
         current_time = datetime.now()
         if cache_time is None or (current_time - cache_time).total_seconds() >= 14:
-            with cache_lock:
-                timestamp = int(time.time() * 1000)
-                base_url = f"https://wpetitions.assembly.go.kr/ts.wseq?opcode=5101&nfid=0&prefix=NetFunnel.gRtype=5101;&sid=service_1&aid=naep_1&js=yes&{timestamp}="
-                try:
-                    response = requests.get(base_url)
-                    nwait_value = extract_nwait(response.text)
-
-                    if nwait_value is not None:
-                        current_time_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
-                        cache['wait_times'].append((current_time_str, nwait_value))
-                        if len(cache['wait_times']) > 50000:
-                            cache['wait_times'] = cache['wait_times'][-50000:]
-                        cache['latest_timestamp'] = current_time_str
-                        cache['latest_count'] = nwait_value
-                        cache_time = current_time
-                        print(f"{current_time_str}: Waiting: {nwait_value}")
-
-                        saved = False
-                        try:
-                            with open(data_file, 'w') as file:
-                                json.dump(cache['wait_times'], file)
-                            saved = True
-                        except Exception as e:
-                            print(f"Error saving to file on first attempt: {e}")
-
-                        if not saved:
-                            # Retry saving once more
-                            try:
-                                with open(data_file, 'w') as file:
-                                    json.dump(cache['wait_times'], file)
-                                print("Successfully saved to file on second attempt")
-                            except Exception as e:
-                                print(f"Error saving to file on second attempt: {e}")
-
-                        times = [wt[0] for wt in cache['wait_times']]
-                        waits = [wt[1] for wt in cache['wait_times']]
-                        socketio.emit('update', {
-                            'latest_count': cache['latest_count'],
-                            'latest_timestamp': cache['latest_timestamp'],
-                            'times': times,
-                            'waits': waits
-                        })
-
-                except Exception as e:
-                    print(f"{current_time}: An error occurred: {e}")
+            timestamp = int(time.time() * 1000)
+            base_url = f"https://wpetitions.assembly.go.kr/ts.wseq?opcode=5101&nfid=0&prefix=NetFunnel.gRtype=5101;&sid=service_1&aid=naep_1&js=yes&{timestamp}="
+            try:
+                # Fetch, save and emit all run outside cache_lock; only the swap below takes it
+                response = requests.get(base_url, timeout=TIMEOUT)
+                nwait_value = extract_nwait(response.text)
+
+                if nwait_value is not None:
+                    current_time_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
+                    with cache_lock:
+                        history.append((current_time_str, nwait_value))
+                        add_to_tiers(to_epochs([current_time_str]), [nwait_value])
+                        snapshot = publish_snapshot(cache['seq'] + 1)
+                    cache_time = current_time
+                    print(f"{current_time_str}: Waiting: {nwait_value}")
+
+                    save_wait_time((current_time_str, nwait_value), snapshot['wait_times'])
+
+                    # Only the new point; clients fetch /initial-data when they see a gap in seq
+                    socketio.emit('update', {
+                        'stream': snapshot['stream'],
+                        'seq': snapshot['seq'],
+                        'time': current_time_str,
+                        'wait': nwait_value,
+                        'max_points': MAX_WAIT_ENTRIES,
+                        'latest_count': snapshot['latest_count'],
+                        'latest_timestamp': snapshot['latest_timestamp']
+                    })
+
+            except Exception as e:
+                print(f"{current_time}: An error occurred: {e}")
 
         time.sleep(1)
 
@@ -106,29 +178,88 @@ threading.Thread(target=update_wait_times, daemon=True).start()
 def index():
     return render_template('waiting_count.html')
 
+# The stream and sequence number identify a snapshot's data version
+def data_version(snapshot):
+    return (snapshot['stream'], snapshot['seq'])
+
 @app.route('/initial-data')
 def initial_data():
-    with cache_lock:
-        times = [wt[0] for wt in cache['wait_times']]
-        waits = [wt[1] for wt in cache['wait_times']]
-        return jsonify({
-            'latest_count': cache['latest_count'],
-            'latest_timestamp': cache['latest_timestamp'],
-            'times': times,
-            'waits': waits
-        })
+    snapshot = cache
+    etag = make_etag('initial-data', data_version(snapshot), wants_gzip())
+    # Clients fetch this to recover from a gap in seq, so a cache must not hand out an older body
+    return conditional_response(etag, lambda: encoded_response(snapshot['initial_json'], snapshot['initial_gzip']), NO_CACHE)
+
+RAW_CHUNK_ENTRIES = 5000  # Entries encoded per streamed chunk
+
+# Function to stream a list of entries as one JSON array
+def json_array_chunks(entries):
+    yield b'['
+    for start in range(0, len(entries), RAW_CHUNK_ENTRIES):
+        chunk = json.dumps(entries[start:start + RAW_CHUNK_ENTRIES])[1:-1]
+        yield ((',' if start else '') + chunk).encode()
+    yield b']'
+
+# Function to turn a since/until epoch into the "%Y-%m-%d %H:%M:%S" form used in wait_times
+def time_string(epoch):
+    return None if epoch is None else epoch_to_datetime(epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+# Function to slice the entries after since and up to until out of a snapshot
+def entries_between(wait_times, since, until):
+    low = 0 if since is None else bisect.bisect_right(wait_times, since, key=lambda wt: wt[0])
+    high = len(wait_times) if until is None else bisect.bisect_right(wait_times, until, key=lambda wt: wt[0])
+    return wait_times[low:high]
+
+# Function to read the stored entries after since and up to until as (time, wait) pairs
+def stored_entries(store, since, until):
+    epochs, waits = store.range(WAIT_SERIES, since, until)
+    return list(zip(to_time_strings(epochs), waits.tolist()))
 
+# ?since= (exclusive) and ?until= (inclusive) take epoch seconds or ISO timestamps for incremental fetches.
+# Ranges reaching back past the in-memory history are completed from the store, where stretches
+# older than its RAW_RETENTION come back as one entry per rolled-up bucket, at the bucket's final second.
 @app.route('/raw-data')
 def serve_file():
-    with cache_lock:
-        return jsonify(cache['wait_times'])
+    try:
+        since_epoch = parse_time_param(request.args.get('since'))
+        until_epoch = parse_time_param(request.args.get('until'))
+    except ValueError as e:
+        return make_response(jsonify({'error': f"Invalid since/until: {e}"}), 400)
+    since = time_string(since_epoch)
+    until = time_string(until_epoch)
+    compress = wants_gzip()
+
+    snapshot = cache
+    version = data_version(snapshot)
+    entries = entries_between(snapshot['wait_times'], since, until)
+    if (since_epoch is not None or until_epoch is not None) and store_exists(STORE_FILE_NAME):
+        limit = until_epoch
+        if snapshot['wait_times']:
+            before_history = int(to_epochs([snapshot['wait_times'][0][0]])[0]) - 1
+            limit = before_history if limit is None else min(limit, before_history)
+        if since_epoch is None or limit is None or since_epoch < limit:
+            store = open_store(STORE_FILE_NAME)
+            version += (store.version(WAIT_SERIES)[2],)  # Retention rewrites these rows without a new seq
+            older = stored_entries(store, since_epoch, limit)
+            if older:
+                entries = older + list(entries)
+    etag = make_etag('raw-data', version, since, until, compress)
+    return conditional_response(etag, lambda: streaming_response(json_array_chunks(entries), 'application/json', compress))
     
+# Aggregates (first, last, min, max, delta) of wait counts per bucket of 1m, 5m, 15m, 1h or 1d
+@app.route('/api/buckets')
+def buckets():
+    try:
+        bucket, start, end = parse_bucket_query(request.args)
+    except ValueError as e:
+        return make_response(jsonify({'error': str(e)}), 400)
+
+    etag = make_etag('buckets', data_version(cache), bucket, start, end)
+    return conditional_response(etag, lambda: jsonify({'series': 'wait', 'bucket': bucket, 'rows': wait_tiers[bucket].aggregate(start, end)}))
+
 @app.route('/latest-data')
 def latest_data():
-    with cache_lock:
-        latest_entry = cache['wait_times'][-1] if cache['wait_times'] else ("", 0)
-        latest_data_formatted = [[latest_entry[0], latest_entry[1]]]
-        return jsonify(latest_data_formatted)
+    snapshot = cache
+    return encoded_response(snapshot['latest_json'], snapshot['latest_gzip'])
 
 @socketio.on('connect')
 def handle_connect():
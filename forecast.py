@@ -0,0 +1,103 @@
+import threading
+from collections import deque
+
+MAX_SAMPLE_WEIGHT = 600  # seconds; longer gaps (poller down) count no more than this
+
+# Weighted least-squares line of count over time, kept as running sums so each sample costs O(1).
+# half_life (seconds) decays old samples exponentially; window (seconds) drops samples older than it.
+# Each sample is weighted by how long its count held, so change-only logs are not biased toward bursts.
+class OnlineRegression:
+    def __init__(self, half_life=None, window=None):
+        if half_life and window:
+            raise ValueError("Use either half_life or window, not both")
+        self.half_life = half_life
+        self.window = window
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, generation):
+        self._generation = generation
+        self._consumed = 0
+        self._origin = None  # Time x = 0 refers to; moved to the newest sample to keep sums small
+        self._pending = None  # Newest (time, count), weighted once the next sample arrives
+        self._samples = deque()  # (time, count, weight) inside the window, fixed-window variant only
+        self._w = self._x = self._y = self._xx = self._xy = 0.0
+
+    def _rebase(self, origin):
+        if self._origin is not None:
+            shift = origin - self._origin
+            self._xx -= 2 * shift * self._x - shift * shift * self._w
+            self._xy -= shift * self._y
+            self._x -= shift * self._w
+        self._origin = origin
+
+    def _accumulate(self, t, y, weight):
+        x = t - self._origin
+        self._w += weight
+        self._x += weight * x
+        self._y += weight * y
+        self._xx += weight * x * x
+        self._xy += weight * x * y
+
+    def _add(self, t, y):
+        if self._pending is not None:
+            pending_t, pending_y = self._pending
+            if t <= pending_t:
+                self._pending = (pending_t, y)
+                return
+            if self.half_life:
+                decay = 0.5 ** ((t - pending_t) / self.half_life)
+                self._w *= decay
+                self._x *= decay
+                self._y *= decay
+                self._xx *= decay
+                self._xy *= decay
+            self._rebase(t)
+            weight = min(t - pending_t, MAX_SAMPLE_WEIGHT)
+            self._accumulate(pending_t, pending_y, weight)
+            if self.window:
+                self._samples.append((pending_t, pending_y, weight))
+                while self._samples and self._samples[0][0] < t - self.window:
+                    old_t, old_y, old_weight = self._samples.popleft()
+                    self._accumulate(old_t, old_y, -old_weight)
+        else:
+            self._rebase(t)
+        self._pending = (t, y)
+
+    def add(self, t, y):
+        with self._lock:
+            self._add(t, y)
+
+    # Fold in the rows appended to a log series since the last call
+    def update(self, series):
+        generation, epochs, counts = series.view()
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+            elif len(epochs) < self._consumed:
+                return  # Another thread already folded in a newer view of the same generation
+            for t, y in zip(epochs[self._consumed:].tolist(), counts[self._consumed:].tolist()):
+                self._add(t, y)
+            self._consumed = len(epochs)
+
+    # (slope per second, count at origin, origin epoch), or None without enough data
+    def fit(self):
+        with self._lock:
+            denominator = self._w * self._xx - self._x * self._x
+            if self._w <= 0 or denominator <= 0:
+                return None
+            slope = (self._w * self._xy - self._x * self._y) / denominator
+            intercept = (self._y - slope * self._x) / self._w
+            return slope, intercept, self._origin
+
+    # Epoch seconds at which each target is reached, None where the trend never gets there
+    def predict(self, targets):
+        fitted = self.fit()
+        result = {}
+        for target in targets:
+            if fitted is None or fitted[0] <= 0:
+                result[target] = None
+            else:
+                slope, intercept, origin = fitted
+                result[target] = origin + (target - intercept) / slope
+        return result
@@ -0,0 +1,158 @@
+import gzip
+import hashlib
+import threading
+import zlib
+from functools import wraps
+from flask import Response, request, make_response
+
+# Proxies and CDNs may keep a response for a couple of seconds, then revalidate with the ETag
+CACHE_CONTROL = 'public, max-age=2, stale-while-revalidate=30'
+# For resync endpoints that must never be answered with an old body, only revalidated with the ETag
+NO_CACHE = 'no-cache'
+
+# Function to turn a data version into a strong ETag value
+def make_etag(*version):
+    return hashlib.sha1(repr(version).encode()).hexdigest()[:20]
+
+STREAM_CHUNK_SIZE = 1 << 16
+
+# Function to check whether the client accepts a gzip-encoded body
+def wants_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+# Function to gzip a stream of byte chunks on the fly
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+# Function to read a file in chunks, starting at a byte offset
+def file_chunks(file_path, offset=0):
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        for chunk in iter(lambda: file.read(STREAM_CHUNK_SIZE), b''):
+            yield chunk
+
+# Function to stream byte chunks, gzip-compressed when the client accepts it
+def streaming_response(chunks, mimetype, compress=False):
+    if compress:
+        response = Response(gzip_chunks(chunks), mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(chunks, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# Function to gzip a body once, ahead of the requests that will be served it
+def gzip_bytes(data):
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+# Function to serve a body encoded ahead of time, picking the gzip copy when the client accepts it
+def encoded_response(body, gzipped, mimetype='application/json'):
+    if wants_gzip():
+        response = Response(gzipped, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# Response bodies cached per data version: a new version invalidates at once, and while one
+# request recomputes an entry the others keep getting the previous body (stale-while-revalidate)
+class VersionedCache:
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = {}  # key -> (version, value)
+        self._computing = {}  # key -> Event set when the running computation finishes
+        self._lock = threading.Lock()
+
+    def get(self, key, version, compute):
+        return self.get_versioned(key, version, compute)[1]
+
+    # Like get(), but returns (version served, value); after a stale hit that is the older version
+    def get_versioned(self, key, version, compute):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == version:
+                    self.hits += 1
+                    return entry
+                running = self._computing.get(key)
+                if running is not None and entry is not None:
+                    self.stale_hits += 1
+                    return entry
+                if running is None:
+                    # Single flight: this caller computes, everyone else waits or gets the stale value
+                    self.misses += 1
+                    running = threading.Event()
+                    self._computing[key] = running
+                    break
+            running.wait()
+
+        try:
+            value = compute()
+            with self._lock:
+                self._entries.pop(key, None)
+                self._entries[key] = (version, value)
+                while len(self._entries) > self.maxsize:
+                    self._entries.pop(next(iter(self._entries)))  # Oldest insertion first
+            return version, value
+        finally:
+            with self._lock:
+                del self._computing[key]
+            running.set()
+
+    # Function to cache a Flask response as bytes, and hand out a fresh Response object per request.
+    # etag(version) tags the response with the version actually served, which is the older one
+    # on a stale hit, so clients revalidate instead of pinning the old body under the new tag.
+    def response(self, key, version, build, etag=None):
+        def freeze():
+            built = make_response(build())
+            return built.get_data(), built.status_code, built.mimetype
+        served, (body, status, mimetype) = self.get_versioned(key, version, freeze)
+        response = Response(body, status=status, mimetype=mimetype)
+        if etag is not None:
+            response.set_etag(etag(served))
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'entries': len(self._entries)
+            }
+
+# Caching decorator; version() returns the current data version the result depends on,
+# etag(version) optionally tags the response with the version it was built from
+def cached(cache, version, etag=None):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            cache_key = f.__name__ + str(args) + str(kwargs)
+            return cache.response(cache_key, version(), lambda: f(*args, **kwargs), etag)
+        return decorated_function
+    return decorator
+
+# Function to answer 304 when the client already has this version; build() only runs otherwise.
+# A response build() already tagged (an older version served from a cache) keeps its own ETag.
+def conditional_response(etag, build, cache_control=CACHE_CONTROL):
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    if response.get_etag()[0] is None:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
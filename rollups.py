@@ -0,0 +1,144 @@
+import bisect
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)  # Epoch seconds in the logs are naive local time
+
+# Bucket sizes kept precomputed as data arrives
+ROLLUP_TIERS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '1h': 3600,
+    '1d': 86400
+}
+
+# Function to turn a log epoch back into a naive datetime
+def epoch_to_datetime(epoch):
+    return EPOCH + timedelta(seconds=int(epoch))
+
+# Function to read a start/end query parameter given as epoch seconds or an ISO timestamp
+def parse_time_param(value):
+    if value is None or value == '':
+        return None
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)  # The logs hold this host's local time
+    return int((parsed - EPOCH).total_seconds())
+
+# Function to read bucket, start and end from a request's query string; raises ValueError
+def parse_bucket_query(args):
+    bucket = args.get('bucket', '1h')
+    if bucket not in ROLLUP_TIERS:
+        raise ValueError(f"bucket must be one of {', '.join(ROLLUP_TIERS)}")
+    return bucket, parse_time_param(args.get('start')), parse_time_param(args.get('end'))
+
+# Per-bucket first/last/min/max counts of a series, updated in place as rows are appended.
+# fill_gaps carries the last count through empty buckets, which is only right for step-wise
+# series like the change-only agree log; sampled series such as wait counts leave gaps empty.
+class Rollup:
+    def __init__(self, bucket_seconds, fill_gaps=False):
+        self.bucket_seconds = bucket_seconds
+        self.fill_gaps = fill_gaps
+        self.buckets = {}  # bucket start epoch -> [first, last, min, max]
+        self._keys = []  # Sorted bucket starts
+        self._generation = None
+        self._consumed = 0  # Rows of the series already folded in
+        self._lock = threading.Lock()
+
+    def _reset(self, generation):
+        self.buckets = {}
+        self._keys = []
+        self._generation = generation
+        self._consumed = 0
+
+    def _insert(self, key, entry):
+        self.buckets[key] = entry
+        if not self._keys or key > self._keys[-1]:
+            self._keys.append(key)
+        else:
+            bisect.insort(self._keys, key)
+
+    def _fill_gap(self, key):
+        # Buckets without a row kept the previous count (change-only log)
+        if not self._keys or key <= self._keys[-1]:
+            return
+        last_key = self._keys[-1]
+        previous_count = self.buckets[last_key][1]
+        for missing in range(last_key + self.bucket_seconds, key, self.bucket_seconds):
+            self._insert(missing, [previous_count] * 4)
+
+    def _add(self, epochs, counts):
+        if not len(epochs):
+            return
+        keys = epochs - epochs % self.bucket_seconds
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)] - 1
+        # Per-bucket aggregates in one pass each, so the loop below only touches Python ints
+        columns = zip(keys[starts].tolist(), counts[starts].tolist(), counts[ends].tolist(),
+                      np.minimum.reduceat(counts, starts).tolist(), np.maximum.reduceat(counts, starts).tolist())
+        for key, first, last, low, high in columns:
+            entry = self.buckets.get(key)
+            if entry is None:
+                if self.fill_gaps:
+                    self._fill_gap(key)
+                self._insert(key, [first, last, low, high])
+            else:
+                entry[1] = last
+                entry[2] = min(entry[2], low)
+                entry[3] = max(entry[3], high)
+
+    # Fold in samples pushed directly, e.g. by a poller that keeps no series object
+    def add_samples(self, epochs, counts):
+        with self._lock:
+            self._add(np.asarray(epochs, dtype=np.int64), np.asarray(counts, dtype=np.int64))
+
+    # Fold in the rows appended to the series since the last call
+    def update(self, series):
+        generation, epochs, counts = series.view()
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+            elif len(epochs) < self._consumed:
+                return  # Another thread already folded in a newer view of the same generation
+            if len(epochs) > self._consumed:
+                self._add(epochs[self._consumed:], counts[self._consumed:])
+                self._consumed = len(epochs)
+
+    # Sorted (bucket start, first, last, min, max) rows with start <= bucket start < end
+    def rows(self, start=None, end=None):
+        with self._lock:
+            low = 0 if start is None else bisect.bisect_left(self._keys, start - start % self.bucket_seconds)
+            high = len(self._keys) if end is None else bisect.bisect_left(self._keys, end)
+            return [(key, *self.buckets[key]) for key in self._keys[low:high]]
+
+    # JSON-ready rows; delta is the change since the previous bucket's last count
+    def aggregate(self, start=None, end=None):
+        rows = self.rows(start, end)
+        with self._lock:
+            index = bisect.bisect_left(self._keys, rows[0][0]) if rows else 0
+            previous = self.buckets[self._keys[index - 1]][1] if index > 0 else None
+        result = []
+        for key, first, last, low, high in rows:
+            result.append({
+                'start': epoch_to_datetime(key).isoformat(),
+                'first': first,
+                'last': last,
+                'min': low,
+                'max': high,
+                'delta': last - (first if previous is None else previous)
+            })
+            previous = last
+        return result
+
+# Function to create one rollup per precomputed tier
+def make_tiers(fill_gaps=False):
+    return {name: Rollup(seconds, fill_gaps) for name, seconds in ROLLUP_TIERS.items()}
+
+# Function to bring every tier up to date with a series
+def update_tiers(tiers, series):
+    for rollup in tiers.values():
+        rollup.update(series)
@@ -0,0 +1,81 @@
+import atexit
+import json
+import os
+import socket
+import time
+
+CHANNEL_DIR = 'agreecount_channel'  # Each subscriber binds one Unix datagram socket in here
+FALLBACK_INTERVAL = 1  # seconds between file checks while no publisher is heard
+PUBLISHER_TIMEOUT = 90  # seconds of silence before the publisher is presumed gone
+MAX_MESSAGE_SIZE = 4096
+
+# Function to send a sample to every subscriber; never blocks the poller
+def publish_sample(epoch, count):
+    if not hasattr(socket, 'AF_UNIX') or not os.path.isdir(CHANNEL_DIR):
+        return 0
+
+    message = json.dumps({'epoch': epoch, 'count': count}).encode()
+    sent = 0
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for name in os.listdir(CHANNEL_DIR):
+            if not name.endswith('.sock'):
+                continue
+            path = os.path.join(CHANNEL_DIR, name)
+            try:
+                sock.sendto(message, path)
+                sent += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The subscriber exited without removing its socket
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                pass  # Queue full, the subscriber catches up from the log file
+    return sent
+
+# Receives samples from AgreeCount; wait() doubles as the fallback file-check timer
+class SampleSubscriber:
+    def __init__(self, name):
+        os.makedirs(CHANNEL_DIR, exist_ok=True)
+        self.path = os.path.join(CHANNEL_DIR, f"{name}-{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self.last_message = None  # monotonic time of the last sample received
+        atexit.register(self.close)
+
+    def publisher_alive(self):
+        return self.last_message is not None and time.monotonic() - self.last_message < PUBLISHER_TIMEOUT
+
+    # Wait for the next sample; returns it as a dict, or None once the wait times out
+    def wait(self):
+        self._sock.settimeout(PUBLISHER_TIMEOUT if self.publisher_alive() else FALLBACK_INTERVAL)
+        try:
+            data = self._sock.recv(MAX_MESSAGE_SIZE)
+        except socket.timeout:
+            return None
+        self.last_message = time.monotonic()
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def close(self):
+        self._sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+# Function to subscribe if the platform supports it; None means fall back to polling the file
+def open_subscriber(name):
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    try:
+        return SampleSubscriber(name)
+    except OSError as e:
+        print(f"Sample channel unavailable, watching the log file instead: {e}")
+        return None
@@ -0,0 +1,206 @@
+import calendar
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import numpy as np
+
+STORE_FILE_NAME = 'petition_series.db'
+AGREE_SERIES = 'agree'
+WAIT_SERIES = 'wait'
+BUSY_TIMEOUT = 5  # seconds a writer waits for the other writer's transaction
+
+# Tiered retention: raw samples for RAW_RETENTION, then 1-minute rollups for MINUTE_RETENTION,
+# then 1-hour rollups for good, so the whole history of the petition stays queryable
+RAW_RETENTION = 3 * 86400  # seconds
+MINUTE_RETENTION = 30 * 86400  # seconds
+RETENTION_INTERVAL = 3600  # seconds between retention passes by a writer
+ROLLUP_BUCKETS = (3600, 60)  # Oldest tier first
+
+SCHEMA = ["""
+CREATE TABLE IF NOT EXISTS samples (
+    series TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (series, epoch)
+) WITHOUT ROWID
+""", """
+CREATE TABLE IF NOT EXISTS rollups (
+    series TEXT NOT NULL,
+    bucket_seconds INTEGER NOT NULL,
+    epoch INTEGER NOT NULL,
+    first INTEGER NOT NULL,
+    last INTEGER NOT NULL,
+    min INTEGER NOT NULL,
+    max INTEGER NOT NULL,
+    PRIMARY KEY (series, bucket_seconds, epoch)
+) WITHOUT ROWID
+""", """
+CREATE TABLE IF NOT EXISTS series_meta (
+    series TEXT NOT NULL PRIMARY KEY,
+    compactions INTEGER NOT NULL
+) WITHOUT ROWID
+"""]
+
+# Function to combine time-ordered rows into (bucket start, first, last, min, max) per bucket
+def rollup_rows(epochs, firsts, lasts, lows, highs, bucket_seconds):
+    keys = epochs // bucket_seconds * bucket_seconds
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    return list(zip(keys[starts].tolist(), firsts[starts].tolist(), lasts[ends].tolist(),
+                    np.minimum.reduceat(lows, starts).tolist(), np.maximum.reduceat(highs, starts).tolist()))
+
+# SQLite store of (epoch seconds, value) series shared by all the services. WAL mode lets
+# the AgreeCount and check_waiting writers append while any number of readers query ranges.
+class SeriesStore:
+    def __init__(self, file_path=STORE_FILE_NAME):
+        self.file_path = file_path
+        self._local = threading.local()  # sqlite3 connections stay on the thread that opened them
+        self._last_retention = {}  # series -> epoch of this process's last retention pass
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.file_path, timeout=BUSY_TIMEOUT)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints, enough for samples
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    # Function to store one sample; a second sample within the same second replaces the first
+    def append(self, series, epoch, value):
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO samples VALUES (?, ?, ?)', (series, int(epoch), int(value)))
+
+    # Function to store many samples in one transaction
+    def append_many(self, series, epochs, values):
+        rows = [(series, epoch, value) for epoch, value in zip(np.asarray(epochs).tolist(), np.asarray(values).tolist())]
+        with self._connection() as connection:
+            connection.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?)', rows)
+
+    # Epochs and values with since < epoch <= until, as int64 arrays in time order. Rolled-up
+    # stretches read as each bucket's last value at the bucket's final second, so the tiers
+    # join into one step series.
+    def range(self, series, since=None, until=None):
+        branches = []
+        params = []
+        for bucket_seconds in ROLLUP_BUCKETS:
+            branch = (f'SELECT epoch + {bucket_seconds - 1}, last FROM rollups'
+                      f' WHERE series = ? AND bucket_seconds = {bucket_seconds}')
+            params.append(series)
+            if since is not None:
+                branch += ' AND epoch > ?'
+                params.append(int(since) - (bucket_seconds - 1))
+            if until is not None:
+                branch += ' AND epoch <= ?'
+                params.append(int(until) - (bucket_seconds - 1))
+            branches.append(branch)
+        branch = 'SELECT epoch, value FROM samples WHERE series = ?'
+        params.append(series)
+        if since is not None:
+            branch += ' AND epoch > ?'
+            params.append(int(since))
+        if until is not None:
+            branch += ' AND epoch <= ?'
+            params.append(int(until))
+        branches.append(branch)
+
+        rows = self._connection().execute(' UNION ALL '.join(branches) + ' ORDER BY 1', params).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        data = np.array(rows, dtype=np.int64)
+        return data[:, 0], data[:, 1]
+
+    # (first epoch, last epoch) across all tiers, both None for an empty series. Each end of each
+    # tier is its own ORDER BY ... LIMIT 1 query, which reads one primary key entry; MIN and MAX
+    # in one SELECT would scan the whole series.
+    def bounds(self, series):
+        connection = self._connection()
+        tiers = [('samples', '', 0)]
+        tiers += [('rollups', f' AND bucket_seconds = {bucket_seconds}', bucket_seconds - 1) for bucket_seconds in ROLLUP_BUCKETS]
+        firsts = []
+        lasts = []
+        for table, condition, offset in tiers:
+            for direction, found in (('ASC', firsts), ('DESC', lasts)):
+                row = connection.execute(f'SELECT epoch FROM {table} WHERE series = ?{condition}'
+                                         f' ORDER BY epoch {direction} LIMIT 1', (series,)).fetchone()
+                if row is not None:
+                    found.append(row[0] + offset)
+        return (min(firsts) if firsts else None, max(lasts) if lasts else None)
+
+    # Changes whenever the series gains samples or a retention pass rewrites older ones
+    def version(self, series):
+        row = self._connection().execute('SELECT compactions FROM series_meta WHERE series = ?', (series,)).fetchone()
+        return self.bounds(series) + (row[0] if row else 0,)
+
+    def latest(self, series):
+        last = self.bounds(series)[1]
+        if last is None:
+            return None
+        epochs, values = self.range(series, since=last - 1)
+        return int(epochs[-1]), int(values[-1])
+
+    def is_empty(self, series):
+        return self.bounds(series)[0] is None
+
+    # Function to fold raw samples past RAW_RETENTION into 1-minute rollups, and those past
+    # MINUTE_RETENTION into 1-hour rollups. Only whole buckets are folded, in one transaction.
+    def apply_retention(self, series, now=None):
+        now = calendar.timegm(datetime.now().timetuple()) if now is None else now
+        raw_cutoff = (now - RAW_RETENTION) // 60 * 60
+        minute_cutoff = (now - MINUTE_RETENTION) // 3600 * 3600
+        folded = 0
+        connection = self._connection()
+        with connection:
+            rows = connection.execute('SELECT epoch, value FROM samples WHERE series = ? AND epoch < ? ORDER BY epoch',
+                                      (series, raw_cutoff)).fetchall()
+            if rows:
+                epochs, values = np.array(rows, dtype=np.int64).T
+                connection.executemany('INSERT OR REPLACE INTO rollups VALUES (?, 60, ?, ?, ?, ?, ?)',
+                                       [(series,) + row for row in rollup_rows(epochs, values, values, values, values, 60)])
+                connection.execute('DELETE FROM samples WHERE series = ? AND epoch < ?', (series, raw_cutoff))
+                folded += len(rows)
+
+            rows = connection.execute('SELECT epoch, first, last, min, max FROM rollups'
+                                      ' WHERE series = ? AND bucket_seconds = 60 AND epoch < ? ORDER BY epoch',
+                                      (series, minute_cutoff)).fetchall()
+            if rows:
+                epochs, firsts, lasts, lows, highs = np.array(rows, dtype=np.int64).T
+                connection.executemany('INSERT OR REPLACE INTO rollups VALUES (?, 3600, ?, ?, ?, ?, ?)',
+                                       [(series,) + row for row in rollup_rows(epochs, firsts, lasts, lows, highs, 3600)])
+                connection.execute('DELETE FROM rollups WHERE series = ? AND bucket_seconds = 60 AND epoch < ?',
+                                   (series, minute_cutoff))
+                folded += len(rows)
+
+            if folded:
+                # Tells readers holding a copy of this series that its older rows were rewritten
+                connection.execute('INSERT INTO series_meta VALUES (?, 1)'
+                                   ' ON CONFLICT (series) DO UPDATE SET compactions = compactions + 1', (series,))
+        return folded
+
+    # Function for writers to call after appending; runs a retention pass every RETENTION_INTERVAL
+    def maybe_apply_retention(self, series, now=None):
+        now = calendar.timegm(datetime.now().timetuple()) if now is None else now
+        if now - self._last_retention.get(series, 0) < RETENTION_INTERVAL:
+            return 0
+        self._last_retention[series] = now
+        return self.apply_retention(series, now)
+
+store_registry = {}
+registry_lock = threading.Lock()
+
+# Function to get the shared store for a database file
+def open_store(file_path=STORE_FILE_NAME):
+    with registry_lock:
+        store = store_registry.get(file_path)
+        if store is None:
+            store = SeriesStore(file_path)
+            store_registry[file_path] = store
+        return store
+
+# Function to check whether a writer has created the store yet
+def store_exists(file_path=STORE_FILE_NAME):
+    return os.path.exists(file_path)
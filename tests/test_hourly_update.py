@@ -0,0 +1,99 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AgreeCount
+import WebsitePNG
+import agree_log
+import series_store
+from agree_log import LOG_FILE_NAME, format_log_lines
+from rollups import make_tiers
+from series_store import AGREE_SERIES, STORE_FILE_NAME, open_store
+
+START_EPOCH = 1719792000  # 2024-07-01 00:00:00, naive local time like the real logs
+
+# Function to make change-only samples: one every 7 minutes, the count growing by 1..40
+def make_samples(start, rows, seed):
+    rng = np.random.default_rng(seed)
+    epochs = start + 420 * np.arange(rows)
+    counts = np.cumsum(rng.integers(1, 41, rows))
+    return epochs, counts
+
+# Function to append samples to the text log the way AgreeCount writes it
+def append_log(epochs, counts):
+    with open(LOG_FILE_NAME, 'a') as file:
+        file.write(format_log_lines(epochs, counts))
+
+def assert_matches_full_scan(client):
+    rollup = client.get('/api/1_hour_update/json').get_json()
+    assert rollup
+    assert rollup == WebsitePNG.hourly_update_full_scan(LOG_FILE_NAME)
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    agree_log.series_registry.clear()
+    series_store.store_registry.clear()
+    monkeypatch.setattr(agree_log, 'store_ready', False)
+    monkeypatch.setattr(WebsitePNG, 'agree_tiers', make_tiers(fill_gaps=True))
+    WebsitePNG.cache.clear()
+    return WebsitePNG.app.test_client()
+
+def test_initial_load(client):
+    append_log(*make_samples(START_EPOCH, 2000, seed=1))
+    assert_matches_full_scan(client)
+
+def test_appends_and_gap(client):
+    epochs, counts = make_samples(START_EPOCH, 1000, seed=2)
+    append_log(epochs, counts)
+    assert_matches_full_scan(client)
+
+    # A few rows in the last hour, then nothing logged for five hours
+    more_epochs, more_counts = make_samples(int(epochs[-1]) + 60, 3, seed=3)
+    append_log(more_epochs, counts[-1] + more_counts)
+    assert_matches_full_scan(client)
+    later_epochs, later_counts = make_samples(int(more_epochs[-1]) + 5 * 3600, 200, seed=4)
+    append_log(later_epochs, counts[-1] + more_counts[-1] + later_counts)
+    assert_matches_full_scan(client)
+
+def test_trimmed_log(client, monkeypatch):
+    epochs, counts = make_samples(START_EPOCH, 1500, seed=5)
+    append_log(epochs, counts)
+    assert_matches_full_scan(client)
+
+    monkeypatch.setattr(AgreeCount, 'MAX_LOG_LINES', 800)
+    monkeypatch.setattr(AgreeCount, 'COMPACT_LOG_LINES', 1000)
+    monkeypatch.setattr(AgreeCount, 'log_line_count', None)
+    AgreeCount.manage_log_file()  # Swaps in the last 800 lines with os.replace
+    with open(LOG_FILE_NAME, 'r') as file:
+        assert len(file.readlines()) == 800
+    assert_matches_full_scan(client)
+
+    more_epochs, more_counts = make_samples(int(epochs[-1]) + 420, 100, seed=6)
+    append_log(more_epochs, counts[-1] + more_counts)
+    assert_matches_full_scan(client)
+
+def test_store_backed_series(client):
+    epochs, counts = make_samples(START_EPOCH, 2000, seed=7)
+    append_log(epochs, counts)
+    assert AgreeCount.import_log_into_store() == len(epochs)
+    assert agree_log.default_log_path() == STORE_FILE_NAME
+    assert_matches_full_scan(client)
+
+    # A retention pass folds the first day into minute rollups; the hourly counts must not move
+    store = open_store(STORE_FILE_NAME)
+    assert store.apply_retention(AGREE_SERIES, START_EPOCH + 4 * 86400)
+    more_epochs, more_counts = make_samples(int(epochs[-1]) + 3 * 3600, 100, seed=8)
+    more_counts = counts[-1] + more_counts
+    append_log(more_epochs, more_counts)
+    store.append_many(AGREE_SERIES, more_epochs, more_counts)
+    assert_matches_full_scan(client)
+
+    # A fresh reader only sees the rolled-up history
+    agree_log.series_registry.clear()
+    WebsitePNG.cache.clear()
+    WebsitePNG.agree_tiers = make_tiers(fill_gaps=True)
+    assert_matches_full_scan(client)
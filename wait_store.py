@@ -0,0 +1,139 @@
+import json
+import os
+import numpy as np
+
+JOURNAL_SUFFIX = '.journal'
+COMPACT_EVERY = 256  # samples between snapshot rewrites, about an hour at one sample per 14 s
+# Columnar snapshot record: epoch seconds (naive local time), wait count, and the
+# "%Y-%m-%d %H:%M:%S" string check_waiting serves, so loading never re-formats timestamps
+COLUMNAR_DTYPE = np.dtype([('epoch', '<i8'), ('count', '<i8'), ('time', '<U19')])
+
+# Function to name the journal that sits next to a wait_times.json snapshot
+def journal_path(file_path):
+    return file_path + JOURNAL_SUFFIX
+
+# Function to name the .npy copy of a wait_times.json snapshot
+def columnar_path(file_path):
+    return os.path.splitext(file_path)[0] + '.npy'
+
+# Function to convert "%Y-%m-%d %H:%M:%S" strings to epoch seconds (naive local time)
+def to_epochs(time_strings):
+    return np.array(time_strings, dtype='datetime64[s]').astype(np.int64)
+
+# Function to convert epoch seconds back to "%Y-%m-%d %H:%M:%S" strings
+def to_time_strings(epochs):
+    stamps = np.datetime_as_string(np.asarray(epochs, dtype=np.int64).astype('datetime64[s]'))
+    return [stamp.replace('T', ' ') for stamp in stamps.tolist()]
+
+# Function to read the samples journaled after last_time, as (time, count) tuples
+def read_journal(file_path, last_time=None):
+    entries = []
+    if not os.path.exists(journal_path(file_path)):
+        return entries
+    with open(journal_path(file_path), 'r') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Torn line from a crash in the middle of an append
+            if last_time is not None and entry[0] <= last_time:
+                continue  # Already in the snapshot, compaction stopped before clearing the journal
+            entries.append(tuple(entry))
+            last_time = entry[0]
+    return entries
+
+# Function to load the snapshot as (epochs, counts, times), memory-mapping the .npy copy unless it
+# is missing or stale; times is None for a .npy written before it had the time column
+def load_snapshot_columns(file_path):
+    path = columnar_path(file_path)
+    if os.path.exists(path) and (not os.path.exists(file_path) or os.path.getmtime(path) >= os.path.getmtime(file_path)):
+        records = np.load(path, mmap_mode='r')
+        times = records['time'] if 'time' in records.dtype.names else None
+        return records['epoch'], records['count'], times
+    if not os.path.exists(file_path):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype='<U19')
+    with open(file_path, 'r') as file:
+        data = json.load(file)
+    times = np.array([wt[0] for wt in data], dtype='<U19')
+    return to_epochs(times), np.array([wt[1] for wt in data], dtype=np.int64), times
+
+# Function to load the snapshot and replay the journal on top, as (epochs, counts, times)
+def load_replayed_columns(file_path):
+    epochs, counts, times = load_snapshot_columns(file_path)
+    if not len(epochs):
+        last_time = None
+    elif times is not None:
+        last_time = str(times[-1])
+    else:
+        last_time = to_time_strings(epochs[-1:])[0]
+    replayed = read_journal(file_path, last_time)
+    if replayed:
+        replayed_times = np.array([wt[0] for wt in replayed], dtype='<U19')
+        epochs = np.concatenate([epochs, to_epochs(replayed_times)])
+        counts = np.concatenate([counts, np.array([wt[1] for wt in replayed], dtype=np.int64)])
+        if times is not None:
+            times = np.concatenate([times, replayed_times])
+    return epochs, counts, times
+
+# Function to load the snapshot and replay the journal, as epoch and count arrays
+def load_wait_columns(file_path, max_entries=None):
+    epochs, counts, _ = load_replayed_columns(file_path)
+    if max_entries is not None:
+        epochs, counts = epochs[-max_entries:], counts[-max_entries:]
+    return epochs, counts
+
+# Function to load the history check_waiting keeps: time strings plus epoch and count arrays
+def load_wait_history(file_path, max_entries=None):
+    epochs, counts, times = load_replayed_columns(file_path)
+    if max_entries is not None:
+        epochs, counts = epochs[-max_entries:], counts[-max_entries:]
+        times = None if times is None else times[-max_entries:]
+    times = to_time_strings(epochs) if times is None else times.tolist()
+    return times, epochs, counts
+
+# Function to replace the snapshot through a temp file and an atomic rename
+def write_snapshot(file_path, entries):
+    temp_file_path = file_path + '.tmp'
+    with open(temp_file_path, 'w') as file:
+        json.dump(list(entries), file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file_path, file_path)
+
+# Function to write the .npy copy of the snapshot, also through a temp file and a rename
+def write_columnar(file_path, entries):
+    records = np.empty(len(entries), dtype=COLUMNAR_DTYPE)
+    if len(entries):
+        records['epoch'] = to_epochs([wt[0] for wt in entries])
+        records['count'] = [wt[1] for wt in entries]
+        records['time'] = [wt[0] for wt in entries]
+    temp_file_path = columnar_path(file_path) + '.tmp'
+    with open(temp_file_path, 'wb') as file:
+        np.save(file, records)
+    os.replace(temp_file_path, columnar_path(file_path))
+
+# Appends one line per sample; every COMPACT_EVERY samples the history is folded into the snapshot
+class WaitJournal:
+    def __init__(self, file_path, compact_every=COMPACT_EVERY):
+        self.file_path = file_path
+        self.compact_every = compact_every
+        self.pending = 0  # Samples in the journal that are not in the snapshot yet
+        self._file = None
+
+    # Function to journal one sample; returns True once it is time to compact
+    def append(self, entry):
+        if self._file is None:
+            self._file = open(journal_path(self.file_path), 'a')
+        self._file.write(json.dumps(list(entry)) + '\n')
+        self._file.flush()
+        self.pending += 1
+        return self.pending >= self.compact_every
+
+    # Function to write the full history as the new snapshots, then start an empty journal
+    def compact(self, entries):
+        write_snapshot(self.file_path, entries)
+        write_columnar(self.file_path, entries)  # Written second, so a newer .npy is never stale
+        if self._file is not None:
+            self._file.close()
+        self._file = open(journal_path(self.file_path), 'w')
+        self.pending = 0